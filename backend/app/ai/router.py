@@ -1,15 +1,20 @@
-import json
+import asyncio
+import hashlib
 import os
 import time
 import uuid
-import urllib.request
-import urllib.error
-from dataclasses import dataclass
-from typing import Optional, List, Dict, Any
+from dataclasses import dataclass, field, replace
+from typing import Optional, List, Dict, Any, Tuple, Union
 
+import httpx
 from google import genai
 from google.genai import types
 
+from .. import json_utils
+from ..cache import TTLCache
+from ..http_client import HTTP as _HTTP, OPENAI_BASE_URL
+from ..settings import env_int
+
 
 @dataclass
 class AIResult:
@@ -18,15 +23,91 @@ class AIResult:
     model_used: str
     latency_ms: int
     tokens_used: Optional[int] = None
+    # Set on fresh results of cacheable calls; AIRouter.cache_result stores them under it
+    cache_key: Optional[tuple] = field(default=None, repr=False, compare=False)
 
 
 class AIProviderError(Exception):
-    def __init__(self, message: str, status_code: int = 503, retry_after: Optional[int] = None, retryable: bool = True):
+    def __init__(self, message: Union[str, bytes], status_code: int = 503, retry_after: Optional[int] = None, retryable: bool = True):
         super().__init__(message)
+        self._message = message
         self.status_code = status_code
         self.retry_after = retry_after
         self.retryable = retryable
 
+    def __str__(self) -> str:
+        # Raw provider bodies stay bytes until someone actually reads the message
+        if isinstance(self._message, bytes):
+            self._message = self._message.decode("utf-8", errors="ignore")
+        return self._message
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[int]:
+    if not value:
+        return None
+    try:
+        return int(value)
+    except Exception:
+        return None
+
+
+async def _post_chat_completion(url: str, api_key: str, payload: Dict[str, Any], provider_label: str) -> Dict[str, Any]:
+    try:
+        resp = await _HTTP.post(
+            url,
+            content=json_utils.dumps(payload),
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+            },
+        )
+        resp.raise_for_status()
+        return json_utils.loads(resp.content)
+    except httpx.HTTPStatusError as e:
+        status = e.response.status_code or 503
+        retry_after = _parse_retry_after(e.response.headers.get("retry-after"))
+        raise AIProviderError(e.response.content or f"{provider_label} error", status_code=status, retry_after=retry_after, retryable=status in (429, 500, 502, 503, 504))
+    except Exception as e:
+        raise AIProviderError(str(e), status_code=503, retryable=True)
+
+
+def _chat_messages(prompt: str, system_prompt: Optional[str]) -> List[Dict[str, str]]:
+    # Static instructions go first as a system message so providers can reuse the cached prefix
+    messages = [{"role": "user", "content": prompt}]
+    if system_prompt:
+        messages.insert(0, {"role": "system", "content": system_prompt})
+    return messages
+
+
+def _model_for_provider(raw: str, provider: str) -> Optional[str]:
+    # Model specs look like "provider:model"; return the model only when the provider matches
+    if raw and ":" in raw:
+        prov, model = raw.split(":", 1)
+        if prov.strip().lower() == provider:
+            return model.strip()
+    return None
+
+
+# Substrings that mark an obviously fake key (e.g. "YOUR_KEY", "OPENAI_API_KEY")
+_KEY_PLACEHOLDERS = ("api_key", "your_key", "placeholder")
+
+
+def _is_real_api_key(api_key: str) -> bool:
+    # Detectar placeholders óbvios
+    if not api_key:
+        return False
+    lowered = api_key.lower()
+    if any(x in lowered for x in _KEY_PLACEHOLDERS):
+        return False
+    return len(api_key) > 10
+
+
+async def _generate_with_timeout(provider: "IAIProvider", timeout_ms: int, **kwargs) -> AIResult:
+    try:
+        return await asyncio.wait_for(provider.generate(**kwargs), timeout=timeout_ms / 1000 if timeout_ms > 0 else None)
+    except asyncio.TimeoutError:
+        raise AIProviderError(f"{provider.name} timed out after {timeout_ms}ms", status_code=504, retryable=True)
+
 
 class IAIProvider:
     name: str
@@ -34,7 +115,7 @@ class IAIProvider:
     def is_configured(self) -> bool:
         raise NotImplementedError
 
-    def generate(
+    async def generate(
         self,
         prompt: str,
         model: str,
@@ -42,6 +123,7 @@ class IAIProvider:
         temperature: float,
         response_mime_type: Optional[str] = None,
         media: Optional[List[Dict[str, Any]]] = None,
+        system_prompt: Optional[str] = None,
     ) -> AIResult:
         raise NotImplementedError
 
@@ -51,22 +133,18 @@ class OpenAIProvider(IAIProvider):
 
     def __init__(self, api_key: Optional[str]):
         self.api_key = (api_key or "").strip() if api_key else ""
+        self._configured = _is_real_api_key(self.api_key)
 
     def is_configured(self) -> bool:
-        # Detectar placeholders óbvios
-        if not self.api_key:
-            return False
-        if any(x in self.api_key.lower() for x in ['api_key', 'your_key', 'placeholder', 'openai_api_key']):
-            return False
-        return len(self.api_key) > 10
-
-    def generate(self, prompt: str, model: str, max_tokens: int, temperature: float, response_mime_type: Optional[str] = None, media: Optional[List[Dict[str, Any]]] = None) -> AIResult:
+        return self._configured
+
+    async def generate(self, prompt: str, model: str, max_tokens: int, temperature: float, response_mime_type: Optional[str] = None, media: Optional[List[Dict[str, Any]]] = None, system_prompt: Optional[str] = None) -> AIResult:
         if media:
             raise AIProviderError("OpenAI provider does not support media inputs", status_code=415, retryable=True)
 
         payload = {
             "model": model,
-            "messages": [{"role": "user", "content": prompt}],
+            "messages": _chat_messages(prompt, system_prompt),
             "temperature": temperature,
             "max_tokens": max_tokens,
         }
@@ -74,45 +152,20 @@ class OpenAIProvider(IAIProvider):
             # Ask OpenAI to return strict JSON
             payload["response_format"] = {"type": "json_object"}
 
-        data = json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(
-            "https://api.openai.com/v1/chat/completions",
-            data=data,
-            headers={
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-            },
-            method="POST",
-        )
-
         start = time.time()
+        obj = await _post_chat_completion(f"{OPENAI_BASE_URL}/chat/completions", self.api_key, payload, "OpenAI")
         try:
-            with urllib.request.urlopen(req, timeout=30) as resp:
-                body = resp.read().decode("utf-8")
-            obj = json.loads(body)
             text = obj["choices"][0]["message"]["content"]
             tokens = obj.get("usage", {}).get("total_tokens")
-            return AIResult(
-                output_text=text,
-                provider_used=self.name,
-                model_used=model,
-                latency_ms=int((time.time() - start) * 1000),
-                tokens_used=tokens,
-            )
-        except urllib.error.HTTPError as e:
-            retry_after = None
-            if e.headers:
-                retry_after = e.headers.get("retry-after")
-                if retry_after:
-                    try:
-                        retry_after = int(retry_after)
-                    except Exception:
-                        retry_after = None
-            status = e.code or 503
-            body = e.read().decode("utf-8", errors="ignore")
-            raise AIProviderError(body or "OpenAI error", status_code=status, retry_after=retry_after, retryable=status in (429, 500, 502, 503, 504))
         except Exception as e:
-            raise AIProviderError(str(e), status_code=503, retryable=True)
+            raise AIProviderError(f"Invalid OpenAI response: {e}", status_code=503, retryable=True)
+        return AIResult(
+            output_text=text,
+            provider_used=self.name,
+            model_used=model,
+            latency_ms=int((time.time() - start) * 1000),
+            tokens_used=tokens,
+        )
 
 
 class GeminiProvider(IAIProvider):
@@ -120,17 +173,13 @@ class GeminiProvider(IAIProvider):
 
     def __init__(self, api_key: Optional[str]):
         self.api_key = (api_key or "").strip() if api_key else ""
+        self._configured = _is_real_api_key(self.api_key)
         self.client = genai.Client(api_key=self.api_key) if self.api_key else None
 
     def is_configured(self) -> bool:
-        # Detectar placeholders óbvios
-        if not self.api_key:
-            return False
-        if any(x in self.api_key.lower() for x in ['api_key', 'your_key', 'placeholder', 'gemini_api_key']):
-            return False
-        return len(self.api_key) > 10
-
-    def generate(self, prompt: str, model: str, max_tokens: int, temperature: float, response_mime_type: Optional[str] = None, media: Optional[List[Dict[str, Any]]] = None) -> AIResult:
+        return self._configured
+
+    async def generate(self, prompt: str, model: str, max_tokens: int, temperature: float, response_mime_type: Optional[str] = None, media: Optional[List[Dict[str, Any]]] = None, system_prompt: Optional[str] = None) -> AIResult:
         if not self.client:
             raise AIProviderError("Gemini provider not configured", status_code=503, retryable=False)
 
@@ -146,10 +195,11 @@ class GeminiProvider(IAIProvider):
             temperature=temperature,
             max_output_tokens=max_tokens,
             response_mime_type=response_mime_type,
+            system_instruction=system_prompt,
         )
         start = time.time()
         try:
-            resp = self.client.models.generate_content(
+            resp = await self.client.aio.models.generate_content(
                 model=model,
                 contents=parts if len(parts) > 1 else prompt,
                 config=cfg,
@@ -175,64 +225,35 @@ class GroqProvider(IAIProvider):
 
     def __init__(self, api_key: Optional[str]):
         self.api_key = (api_key or "").strip() if api_key else ""
+        self._configured = _is_real_api_key(self.api_key)
 
     def is_configured(self) -> bool:
-        # Detectar placeholders óbvios
-        if not self.api_key:
-            return False
-        if any(x in self.api_key.lower() for x in ['api_key', 'your_key', 'placeholder', 'groq_api_key']):
-            return False
-        return len(self.api_key) > 10
-
-    def generate(self, prompt: str, model: str, max_tokens: int, temperature: float, response_mime_type: Optional[str] = None, media: Optional[List[Dict[str, Any]]] = None) -> AIResult:
+        return self._configured
+
+    async def generate(self, prompt: str, model: str, max_tokens: int, temperature: float, response_mime_type: Optional[str] = None, media: Optional[List[Dict[str, Any]]] = None, system_prompt: Optional[str] = None) -> AIResult:
         if media:
             raise AIProviderError("Groq provider does not support media inputs", status_code=415, retryable=True)
 
         payload = {
             "model": model,
-            "messages": [{"role": "user", "content": prompt}],
+            "messages": _chat_messages(prompt, system_prompt),
             "temperature": temperature,
             "max_tokens": max_tokens,
         }
-        data = json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(
-            "https://api.groq.com/openai/v1/chat/completions",
-            data=data,
-            headers={
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-            },
-            method="POST",
-        )
-
         start = time.time()
+        obj = await _post_chat_completion("https://api.groq.com/openai/v1/chat/completions", self.api_key, payload, "Groq")
         try:
-            with urllib.request.urlopen(req, timeout=30) as resp:
-                body = resp.read().decode("utf-8")
-            obj = json.loads(body)
             text = obj["choices"][0]["message"]["content"]
             tokens = obj.get("usage", {}).get("total_tokens")
-            return AIResult(
-                output_text=text,
-                provider_used=self.name,
-                model_used=model,
-                latency_ms=int((time.time() - start) * 1000),
-                tokens_used=tokens,
-            )
-        except urllib.error.HTTPError as e:
-            retry_after = None
-            if e.headers:
-                retry_after = e.headers.get("retry-after")
-                if retry_after:
-                    try:
-                        retry_after = int(retry_after)
-                    except Exception:
-                        retry_after = None
-            status = e.code or 503
-            body = e.read().decode("utf-8", errors="ignore")
-            raise AIProviderError(body or "Groq error", status_code=status, retry_after=retry_after, retryable=status in (429, 500, 502, 503, 504))
         except Exception as e:
-            raise AIProviderError(str(e), status_code=503, retryable=True)
+            raise AIProviderError(f"Invalid Groq response: {e}", status_code=503, retryable=True)
+        return AIResult(
+            output_text=text,
+            provider_used=self.name,
+            model_used=model,
+            latency_ms=int((time.time() - start) * 1000),
+            tokens_used=tokens,
+        )
 
 
 class AIRouter:
@@ -242,14 +263,38 @@ class AIRouter:
             "gemini": GeminiProvider(os.environ.get("GEMINI_API_KEY")),
             "groq": GroqProvider(os.environ.get("GROQ_API_KEY")),
         }
+        self._load_model_config()
+        # Delay before a slow provider call is hedged with the next one (0 disables)
+        self.hedge_delay_ms = env_int("AI_HEDGE_DELAY_MS", 0)
+        # Per-provider-call timeout for each task; a timed out call falls through to the next provider
+        self.default_timeout_ms = env_int("AI_REQUEST_TIMEOUT_MS", 30000)
+        self.task_timeouts_ms = {
+            task: env_int(f"AI_REQUEST_TIMEOUT_MS_{task.upper()}", self.default_timeout_ms)
+            for task in ("plan", "evaluate", "report")
+        }
+        # Exact-match response cache for near-deterministic tasks (same prompt -> same answer)
+        self.cache_tasks = {t.strip() for t in os.environ.get("AI_CACHE_TASKS", "plan,report").split(",") if t.strip()}
+        self._cache = TTLCache(
+            maxsize=env_int("AI_CACHE_MAX_ENTRIES", 256),
+            ttl=env_int("AI_CACHE_TTL_SECONDS", 3600),
+        )
         # Log startup configuration for debugging
         self._log_startup_config()
 
-    def _provider_order(self) -> List[str]:
-        raw = os.environ.get("AI_PROVIDER_ORDER", "openai,groq,gemini")
-        return [p.strip() for p in raw.split(",") if p.strip()]
+    def _provider_order(self) -> Tuple[str, ...]:
+        return self._order
 
     def _model_for_task(self, task_name: str, provider: str) -> Optional[str]:
+        model = self._task_models.get((task_name, provider))
+        if model:
+            return model
+        return self._fallback_models.get(provider)
+
+    def _load_model_config(self):
+        """Resolve provider order and per-task models from env once, at startup."""
+        raw = os.environ.get("AI_PROVIDER_ORDER", "openai,groq,gemini")
+        self._order = tuple(p.strip() for p in raw.split(",") if p.strip())
+
         task_map = {
             "plan": os.environ.get("AI_MODEL_PLAN", "openai:gpt-4o-mini"),
             "evaluate": os.environ.get("AI_MODEL_FAST", "openai:gpt-4.1-nano"),
@@ -261,20 +306,41 @@ class AIRouter:
             "openai": os.environ.get("AI_MODEL_FALLBACK_OPENAI", "openai:gpt-4o-mini"),
         }
 
-        raw = task_map.get(task_name) or ""
-        if raw and ":" in raw:
-            prov, model = raw.split(":", 1)
-            if prov.strip().lower() == provider:
-                return model.strip()
-        # fallback for provider
-        raw_fb = fallback_map.get(provider) or ""
-        if raw_fb and ":" in raw_fb:
-            prov, model = raw_fb.split(":", 1)
-            if prov.strip().lower() == provider:
-                return model.strip()
-        return None
+        self._fallback_models: Dict[str, str] = {}
+        for provider, raw_fb in fallback_map.items():
+            model = _model_for_provider(raw_fb, provider)
+            if model:
+                self._fallback_models[provider] = model
+
+        self._task_models: Dict[Tuple[str, str], str] = {}
+        for task_name, raw_task in task_map.items():
+            for provider in self.providers:
+                model = _model_for_provider(raw_task, provider)
+                if model:
+                    self._task_models[(task_name, provider)] = model
 
-    def generate(
+    def _cache_key(
+        self,
+        task_name: str,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        model_override: Optional[str],
+        response_mime_type: Optional[str],
+        media: Optional[List[Dict[str, Any]]],
+        system_prompt: Optional[str],
+    ) -> Optional[tuple]:
+        # Only cache text-only, low-temperature calls, where a repeated prompt should yield the same answer
+        if media or temperature > 0.3 or task_name not in self.cache_tasks:
+            return None
+        hasher = hashlib.blake2b(digest_size=16)
+        if system_prompt:
+            hasher.update(system_prompt.encode("utf-8"))
+        hasher.update(b"\x00")
+        hasher.update(prompt.encode("utf-8"))
+        return (task_name, model_override, response_mime_type, max_tokens, temperature, hasher.digest())
+
+    async def generate(
         self,
         task_name: str,
         prompt: str,
@@ -283,14 +349,22 @@ class AIRouter:
         model_override: Optional[str] = None,
         response_mime_type: Optional[str] = None,
         media: Optional[List[Dict[str, Any]]] = None,
+        system_prompt: Optional[str] = None,
     ) -> AIResult:
         if not any(p.is_configured() for p in self.providers.values()):
             raise AIProviderError("AI not configured", status_code=503, retryable=False)
 
+        cache_key = self._cache_key(task_name, prompt, max_tokens, temperature, model_override, response_mime_type, media, system_prompt)
+        if cache_key is not None:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return replace(cached, latency_ms=0, cache_key=None)
+
         request_id = str(uuid.uuid4())
         last_retry_after = None
         tried = []
 
+        candidates = []
         for provider_name in self._provider_order():
             provider = self.providers.get(provider_name)
             if not provider or not provider.is_configured():
@@ -308,24 +382,61 @@ class AIRouter:
                 model = self._model_for_task(task_name, provider_name)
             if not model:
                 continue
-
-            try:
-                result = provider.generate(
+            candidates.append((provider_name, provider, model))
+
+        # Providers are raced: the next candidate starts as soon as the current
+        # one fails with a retryable error or, when hedging is enabled, once it
+        # has been running for longer than the hedge delay.
+        hedge_delay = self.hedge_delay_ms / 1000 if self.hedge_delay_ms > 0 else None
+        timeout_ms = self.task_timeouts_ms.get(task_name, self.default_timeout_ms)
+        pending: Dict[asyncio.Task, str] = {}
+        next_index = 0
+
+        def _launch_next():
+            nonlocal next_index
+            provider_name, provider, model = candidates[next_index]
+            next_index += 1
+            task = asyncio.create_task(
+                _generate_with_timeout(
+                    provider,
+                    timeout_ms,
                     prompt=prompt,
                     model=model,
                     max_tokens=max_tokens,
                     temperature=temperature,
                     response_mime_type=response_mime_type,
                     media=media,
+                    system_prompt=system_prompt,
                 )
-                return result
-            except AIProviderError as e:
-                tried.append(f"{provider_name}:{model}")
-                if e.retry_after:
-                    last_retry_after = e.retry_after
-                if e.retryable:
+            )
+            pending[task] = f"{provider_name}:{model}"
+
+        try:
+            while pending or next_index < len(candidates):
+                if not pending:
+                    _launch_next()
+                timeout = hedge_delay if next_index < len(candidates) else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    _launch_next()
                     continue
-                raise
+                for task in done:
+                    label = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except AIProviderError as e:
+                        tried.append(label)
+                        if e.retry_after:
+                            last_retry_after = e.retry_after
+                        if not e.retryable:
+                            raise
+                        continue
+                    if cache_key is not None:
+                        result = replace(result, cache_key=cache_key)
+                    return result
+        finally:
+            for task in pending:
+                task.cancel()
 
         raise AIProviderError(
             f"All AI providers failed (tried: {', '.join(tried)})",
@@ -334,6 +445,14 @@ class AIRouter:
             retryable=False,
         )
 
+    def cache_result(self, result: AIResult) -> None:
+        """Store a result for repeat prompts once the caller has validated its output.
+
+        generate() never caches on its own, so a malformed answer is not replayed for the TTL.
+        """
+        if result.cache_key is not None:
+            self._cache.set(result.cache_key, result)
+
     def _log_startup_config(self):
         """Log AI configuration for debugging startup issues"""
         try:
@@ -346,3 +465,14 @@ class AIRouter:
                 logger.warning("No AI providers configured! Check environment variables.")
         except Exception:
             pass  # Don't fail startup if logging fails
+
+
+_router: Optional[AIRouter] = None
+
+
+def get_ai_router() -> AIRouter:
+    """Return the process-wide AIRouter so provider clients and HTTP pools are shared."""
+    global _router
+    if _router is None:
+        _router = AIRouter()
+    return _router
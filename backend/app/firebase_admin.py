@@ -1,14 +1,22 @@
-import json
+import hashlib
 import os
+import time
 from typing import Optional, Dict, Any
 
 import firebase_admin
 from firebase_admin import auth, credentials, firestore
 from fastapi import Depends, Header, HTTPException
 
+from . import json_utils
+from .cache import TTLCache
+
 _app = None
 _db = None
 
+# Verified ID token claims keyed by token hash, kept until shortly before the token's exp
+_TOKEN_CACHE = TTLCache(maxsize=10000, ttl=3600)
+_TOKEN_EXPIRY_MARGIN_S = 30
+
 def init_firebase():
     global _app, _db
     if _app and _db:
@@ -26,7 +34,7 @@ def init_firebase():
     cred = None
     if sa_json:
         try:
-            info = json.loads(sa_json)
+            info = json_utils.loads(sa_json)
             cred = credentials.Certificate(info)
         except Exception as e:
             raise RuntimeError("FIREBASE_SERVICE_ACCOUNT_JSON inválido") from e
@@ -55,24 +63,37 @@ def get_firestore_client():
     return _db
 
 def verify_bearer_token(authorization: Optional[str]) -> Dict[str, Any]:
-    # Ensure Firebase Admin app is initialized before verifying tokens
-    init_firebase()
     if not authorization:
         raise HTTPException(status_code=401, detail="Missing Authorization header")
-    if not authorization.lower().startswith("bearer "):
+    # Only the 7-char scheme prefix is lowercased, not the whole header
+    if authorization[:7].lower() != "bearer ":
         raise HTTPException(status_code=401, detail="Invalid Authorization header")
-    token = authorization.split(" ", 1)[1].strip()
+    token = authorization[7:].strip()
     if not token:
         raise HTTPException(status_code=401, detail="Empty token")
 
+    cache_key = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+    cached = _TOKEN_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Ensure Firebase Admin app is initialized before verifying tokens
+    init_firebase()
     try:
         decoded = auth.verify_id_token(token)
-        return decoded
     except Exception as e:
         # Log exception for debugging in dev
         print(f"verify_bearer_token error: {e}")
         raise HTTPException(status_code=401, detail=f"Invalid or expired token: {str(e)}")
 
+    try:
+        ttl = float(decoded.get("exp", 0)) - time.time() - _TOKEN_EXPIRY_MARGIN_S
+    except Exception:
+        ttl = 0
+    if ttl > 0:
+        _TOKEN_CACHE.set(cache_key, decoded, ttl=ttl)
+    return decoded
+
 def get_current_user(authorization: Optional[str] = Header(default=None)):
     decoded = verify_bearer_token(authorization)
     # best-effort extra fields (frontend can send as claims or we can enrich from Firebase)
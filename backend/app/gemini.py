@@ -1,10 +1,9 @@
-﻿import json
+﻿import asyncio
+import io
 import os
-import time
-import tempfile
 from typing import Any, Dict, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 from google import genai
 from google.genai import types
 from .schemas import (
@@ -16,6 +15,114 @@ from .schemas import (
     InterviewQuestion,
 )
 
+# Static instructions come first in every request so Gemini can reuse the cached prompt prefix;
+# only the small per-request block (config, question, history) varies.
+SYSTEM_PROMPT_PLAN = """
+Voce e um entrevistador de engenharia de software.
+Gere um plano de entrevista (estruturado) a partir da configuracao fornecida.
+
+Regras:
+- Se existir jobDescription, adapte perguntas para ela
+- blueprint: percentuais 0-100 para secoes (hr, technical, design, behavioral) somando ~100
+- questions: 10 a 14 perguntas, cada uma com id, section, difficulty (1-5), prompt
+"""
+
+SYSTEM_PROMPT_EVAL = """
+Voce e um entrevistador tecnico.
+
+Tarefas:
+1) Transcreva a resposta do audio.
+2) Avalie a resposta do candidato em: communication, technical, problemSolving, presence (0-10).
+3) Liste 2-5 strengths e 2-5 improvements.
+4) Se a resposta foi rasa, indique followUpNeeded=true e proponha followUpQuestion (1 pergunta objetiva).
+Retorne JSON.
+"""
+
+SYSTEM_PROMPT_EVAL_BATCH = """
+Voce e um entrevistador tecnico.
+Voce recebera varias perguntas (Q1, Q2, ...), cada uma seguida do audio da resposta.
+
+Tarefas, para cada pergunta:
+1) Transcreva a resposta do audio.
+2) Avalie a resposta do candidato em: communication, technical, problemSolving, presence (0-10).
+3) Liste 2-5 strengths e 2-5 improvements.
+4) Se a resposta foi rasa, indique followUpNeeded=true e proponha followUpQuestion (1 pergunta objetiva).
+Retorne uma lista JSON com uma avaliacao por pergunta, na mesma ordem.
+"""
+
+SYSTEM_PROMPT_REPORT = """
+Analise o historico completo da entrevista e gere um relatorio final.
+
+Retorne JSON com:
+- overallScore (0-10)
+- levelEstimate (string)
+- jobMatch: { covered: [..], gaps: [..] }
+- feedback: { posture: [..], communication: [..], technical: [..], language: [..] }
+- plan7Days: lista de 7 itens (day: 1-7, task: string)
+"""
+
+# Audio below this size is sent inline (Gemini caps inline requests at ~20MB)
+INLINE_AUDIO_MAX_BYTES = 18 * 1024 * 1024
+
+# Backoff schedule (seconds) while an uploaded file is still PROCESSING
+FILE_POLL_DELAYS = (0.1, 0.15, 0.25, 0.4, 0.6, 0.8)
+
+
+# Response shapes are declared once here so pydantic compiles their validators at import.
+# They are also sent as response_schema, which has no free-form dicts, so every object
+# spells out its keys (matching frontend/types.ts).
+class BlueprintOut(BaseModel):
+    hr: float
+    technical: float
+    design: float
+    behavioral: float
+
+
+class PlanOut(BaseModel):
+    roleTitleGuess: str
+    seniorityGuess: str
+    mustHaveSkills: List[str]
+    blueprint: BlueprintOut
+    questions: List[InterviewQuestion]
+
+
+class EvalOut(BaseModel):
+    scores: AnswerScores
+    strengths: List[str] = []
+    improvements: List[str] = []
+    followUpNeeded: bool = False
+    followUpQuestion: Optional[str] = None
+    transcript: str
+
+
+class JobMatchOut(BaseModel):
+    covered: List[str]
+    gaps: List[str]
+
+
+class FeedbackOut(BaseModel):
+    posture: List[str]
+    communication: List[str]
+    technical: List[str]
+    language: List[str]
+
+
+class DayTaskOut(BaseModel):
+    day: int
+    task: str
+
+
+class FinalOut(BaseModel):
+    overallScore: float
+    levelEstimate: str
+    jobMatch: JobMatchOut
+    feedback: FeedbackOut
+    plan7Days: List[DayTaskOut]
+
+
+_EVAL_LIST = TypeAdapter(list[EvalOut])
+
+
 class GeminiClient:
     """
     Wrapper bem simples para Gemini (Google GenAI SDK).
@@ -33,77 +140,83 @@ class GeminiClient:
     def _json_config(self, schema: Any):
         return types.GenerateContentConfig(
             response_mime_type="application/json",
+            response_schema=schema,
             temperature=0.2,
         )
 
-    def generate_plan(self, config: InterviewConfig) -> InterviewPlan:
-        class PlanOut(BaseModel):
-            roleTitleGuess: str
-            seniorityGuess: str
-            mustHaveSkills: List[str]
-            blueprint: Dict[str, float]
-            questions: List[Dict[str, Any]]
+    @staticmethod
+    def _parsed(resp: types.GenerateContentResponse, schema: Any) -> Any:
+        # The SDK parses constrained output into the schema type; validate the raw text if it could not
+        if resp.parsed is not None:
+            return resp.parsed
+        if isinstance(schema, TypeAdapter):
+            return schema.validate_json(resp.text or "")
+        return schema.model_validate_json(resp.text or "")
 
+    def generate_plan(self, config: InterviewConfig) -> InterviewPlan:
         prompt = f"""
-Voce e um entrevistador de engenharia de software.
-Gere um plano de entrevista (estruturado) a partir da configuracao:
-
-Config: {config.model_dump()}
+Config: {config.config_json}
 
 Regras:
 - Idioma das perguntas: {config.interviewLanguage}
-- Se existir jobDescription, adapte perguntas para ela
 - Dificuldade deve refletir {config.seniority}
-- blueprint: percentuais 0-100 para secoes (hr, technical, design, behavioral) somando ~100
-- questions: 10 a 14 perguntas, cada uma com id, section, difficulty (1-5), prompt
 """
 
         resp = self.client.models.generate_content(
             model=self.model,
-            contents=prompt,
+            contents=[
+                types.Part.from_text(text=SYSTEM_PROMPT_PLAN),
+                types.Part.from_text(text=prompt),
+            ],
             config=self._json_config(PlanOut),
         )
-        data = json.loads(resp.text or "{}")
-        questions = [InterviewQuestion(**q) for q in data["questions"]]
+        out: PlanOut = self._parsed(resp, PlanOut)
         return InterviewPlan(
-            roleTitleGuess=data["roleTitleGuess"],
-            seniorityGuess=data["seniorityGuess"],
-            mustHaveSkills=data["mustHaveSkills"],
-            blueprint=data["blueprint"],
-            questions=questions,
+            roleTitleGuess=out.roleTitleGuess,
+            seniorityGuess=out.seniorityGuess,
+            mustHaveSkills=out.mustHaveSkills,
+            blueprint=out.blueprint.model_dump(),
+            questions=out.questions,
+        )
+
+    async def _wait_for_file(self, audio_file: types.File) -> types.File:
+        # Short clips usually finish processing well under a second, so poll with backoff
+        delays = iter(FILE_POLL_DELAYS)
+        while audio_file.state == types.FileState.PROCESSING:
+            await asyncio.sleep(next(delays, FILE_POLL_DELAYS[-1]))
+            audio_file = await self.client.aio.files.get(name=audio_file.name)
+        return audio_file
+
+    async def _upload_part(self, audio_bytes: bytes, mime_type: str) -> types.Part:
+        audio_file = await self.client.aio.files.upload(
+            path=io.BytesIO(audio_bytes),
+            config=types.UploadFileConfig(mime_type=mime_type),
         )
+        audio_file = await self._wait_for_file(audio_file)
+        return types.Part.from_uri(file_uri=audio_file.uri, mime_type=mime_type)
 
-    def extract_first_name(self, audio_bytes: bytes, mime_type: str, ui_language: str) -> str:
+    async def _audio_part(self, audio_bytes: bytes, mime_type: str) -> types.Part:
+        # Inline small clips in the request itself; only large ones go through the Files API
+        if len(audio_bytes) < INLINE_AUDIO_MAX_BYTES:
+            return types.Part.from_bytes(data=audio_bytes, mime_type=mime_type)
+        return await self._upload_part(audio_bytes, mime_type)
+
+    async def extract_first_name(self, audio_bytes: bytes, mime_type: str, ui_language: str) -> str:
         prompt = f"Extraia apenas o primeiro nome da pessoa do audio. Responda somente o nome (1 palavra). Idioma: {ui_language}"
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as tmp:
-            tmp.write(audio_bytes)
-            tmp_path = tmp.name
-
-        try:
-            audio_file = self.client.files.upload(
-                path=tmp_path,
-                config=types.UploadFileConfig(mime_type=mime_type),
-            )
-
-            while audio_file.state == types.FileState.PROCESSING:
-                time.sleep(1)
-                audio_file = self.client.files.get(name=audio_file.name)
-
-            resp = self.client.models.generate_content(
-                model=self.model,
-                contents=[
-                    types.Part.from_text(text=prompt),
-                    types.Part.from_uri(file_uri=audio_file.uri, mime_type=mime_type),
-                ],
-                config=types.GenerateContentConfig(temperature=0.0),
-            )
-            name = (resp.text or "").strip().split()
-            return name[0] if name else "Candidato"
-        finally:
-            os.unlink(tmp_path)
-
-    def evaluate_answer_audio(
+        audio_part = await self._audio_part(audio_bytes, mime_type)
+        resp = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=[
+                types.Part.from_text(text=prompt),
+                audio_part,
+            ],
+            config=types.GenerateContentConfig(temperature=0.0),
+        )
+        name = (resp.text or "").strip().split()
+        return name[0] if name else "Candidato"
+
+    async def evaluate_answer_audio(
         self,
         config: InterviewConfig,
         question: str,
@@ -111,83 +224,91 @@ Regras:
         mime_type: str,
         confirmed_name: Optional[str] = None,
     ) -> AnswerEvaluation:
-        class EvalOut(BaseModel):
-            scores: AnswerScores
-            strengths: List[str] = []
-            improvements: List[str] = []
-            followUpNeeded: bool = False
-            followUpQuestion: Optional[str] = None
-            transcript: str
-
         who = confirmed_name or "o candidato"
         prompt = f"""
-Voce e um entrevistador tecnico. 
 Pergunta: {question}
+Candidato: {who}
 Senioridade alvo: {config.seniority}
 Trilha: {config.track}
 Stacks: {", ".join(config.stacks)}
 Idioma da entrevista: {config.interviewLanguage}
-
-Tarefas:
-1) Transcreva a resposta do audio.
-2) Avalie a resposta do {who} em: communication, technical, problemSolving, presence (0-10).
-3) Liste 2-5 strengths e 2-5 improvements.
-4) Se a resposta foi rasa, indique followUpNeeded=true e proponha followUpQuestion (1 pergunta objetiva).
-Retorne JSON.
 """
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as tmp:
-            tmp.write(audio_bytes)
-            tmp_path = tmp.name
-
-        try:
-            audio_file = self.client.files.upload(
-                path=tmp_path,
-                config=types.UploadFileConfig(mime_type=mime_type),
-            )
-
-            while audio_file.state == types.FileState.PROCESSING:
-                time.sleep(1)
-                audio_file = self.client.files.get(name=audio_file.name)
-
-            resp = self.client.models.generate_content(
-                model=self.model,
-                contents=[
-                    types.Part.from_text(text=prompt),
-                    types.Part.from_uri(file_uri=audio_file.uri, mime_type=mime_type),
-                ],
-                config=self._json_config(EvalOut),
-            )
-            data = json.loads(resp.text or "{}")
-            return AnswerEvaluation(**data)
-        finally:
-            os.unlink(tmp_path)
+        audio_part = await self._audio_part(audio_bytes, mime_type)
+        resp = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=[
+                types.Part.from_text(text=SYSTEM_PROMPT_EVAL),
+                types.Part.from_text(text=prompt),
+                audio_part,
+            ],
+            config=self._json_config(EvalOut),
+        )
+        out: EvalOut = self._parsed(resp, EvalOut)
+        return AnswerEvaluation(**out.model_dump())
 
-    def generate_final_report(self, config: InterviewConfig, history: List[Dict[str, Any]]) -> FinalReport:
-        class FinalOut(BaseModel):
-            overallScore: float
-            levelEstimate: str
-            jobMatch: Dict[str, List[str]]
-            feedback: Dict[str, List[str]]
-            plan7Days: List[Dict[str, Any]]
+    async def evaluate_answers_batch(
+        self,
+        config: InterviewConfig,
+        items: List[Dict[str, Any]],
+        confirmed_name: Optional[str] = None,
+    ) -> List[AnswerEvaluation]:
+        """Evaluate several answers in a single request; items hold question, audio_bytes, mime_type."""
+        if not items:
+            return []
 
-        prompt = f"""
-Analise o historico completo da entrevista e gere um relatorio final.
+        who = confirmed_name or "o candidato"
+        parts = [
+            types.Part.from_text(text=SYSTEM_PROMPT_EVAL_BATCH),
+            types.Part.from_text(text=f"""
+Candidato: {who}
+Senioridade alvo: {config.seniority}
+Trilha: {config.track}
+Stacks: {", ".join(config.stacks)}
+Idioma da entrevista: {config.interviewLanguage}
+"""),
+        ]
+        # The ~20MB inline cap applies to the whole request, so the clips share one inline
+        # budget (in order); whatever does not fit goes through the Files API
+        budget = INLINE_AUDIO_MAX_BYTES
+        audio_parts: List[Optional[types.Part]] = []
+        uploads: Dict[int, Any] = {}
+        for i, item in enumerate(items):
+            if len(item["audio_bytes"]) < budget:
+                budget -= len(item["audio_bytes"])
+                audio_parts.append(types.Part.from_bytes(data=item["audio_bytes"], mime_type=item["mime_type"]))
+            else:
+                audio_parts.append(None)
+                uploads[i] = self._upload_part(item["audio_bytes"], item["mime_type"])
+        for i, part in zip(uploads, await asyncio.gather(*uploads.values())):
+            audio_parts[i] = part
 
-Config: {config.model_dump()}
-Historico: {history}
+        for i, (item, audio_part) in enumerate(zip(items, audio_parts), start=1):
+            parts.append(types.Part.from_text(text=f"Q{i}: {item['question']}"))
+            parts.append(audio_part)
 
-Retorne JSON com:
-- overallScore (0-10)
-- levelEstimate (string)
-- jobMatch: {{ covered: [..], gaps: [..] }}
-- feedback: {{ posture: [..], communication: [..], technical: [..], language: [..] }}
-- plan7Days: lista de 7 itens (day: 1-7, task: string)
+        resp = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=parts,
+            config=self._json_config(list[EvalOut]),
+        )
+        outs: List[EvalOut] = self._parsed(resp, _EVAL_LIST)
+        if len(outs) != len(items):
+            raise ValueError(f"Expected {len(items)} evaluations, got {len(outs)}")
+        return [AnswerEvaluation(**out.model_dump()) for out in outs]
+
+    def generate_final_report(self, config: InterviewConfig, history: List[Dict[str, Any]]) -> FinalReport:
+        prompt = f"""
+Config: {config.config_json}
+Historico: {history}
 """
         resp = self.client.models.generate_content(
             model=self.model,
-            contents=prompt,
+            contents=[
+                types.Part.from_text(text=SYSTEM_PROMPT_REPORT),
+                types.Part.from_text(text=prompt),
+            ],
             config=self._json_config(FinalOut),
         )
-        data = json.loads(resp.text or "{}")
-        return FinalReport(**data)
+        out: FinalOut = self._parsed(resp, FinalOut)
+        return FinalReport(**out.model_dump())
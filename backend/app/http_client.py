@@ -0,0 +1,12 @@
+import httpx
+
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+
+# One shared keep-alive pool for every outbound provider call (chat completions,
+# TTS, transcription), so they reuse TCP/TLS connections under a single set of limits.
+# Relative paths resolve against OpenAI; other providers pass absolute URLs.
+HTTP = httpx.AsyncClient(
+    base_url=OPENAI_BASE_URL,
+    timeout=30.0,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+)
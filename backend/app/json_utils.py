@@ -0,0 +1,21 @@
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # Fallback to stdlib json when orjson is not installed
+    orjson = None
+    import json
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize obj to UTF-8 encoded JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """Deserialize JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -1,23 +1,42 @@
-﻿import os
-import json
+﻿import asyncio
+import os
 import logging
 import uuid
 import base64
+import binascii
 import re
-import urllib.request
-import urllib.error
+import time
+import functools
+import hashlib
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 from typing import Optional
 from datetime import datetime, timezone
 
-from fastapi import Depends, FastAPI, HTTPException, Request
+import httpx
+from anyio import from_thread
+from fastapi import Depends, FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse
+from starlette.routing import Router
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
 from google.cloud import firestore
 from dotenv import load_dotenv
 
+# Load backend/.env when present (local dev); before the app modules below,
+# which read their settings at import
+_env_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".env"))
+load_dotenv(_env_path)
+
 from .firebase_admin import get_firestore_client, get_current_user
-from .ai.router import AIRouter, AIProviderError
+from .cache import TTLCache
+from . import http_client
+from .http_client import HTTP as _OPENAI_HTTP
+from .settings import env_int
+from .ai.router import AIProviderError, AIResult, get_ai_router
+from . import json_utils
 from . import tts as tts_module
 from .schemas import (
     InterviewConfig,
@@ -35,36 +54,28 @@ from .schemas import (
     SessionFinishRequest,
 )
 
-# Load backend/.env when present (local dev)
-_env_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".env"))
-load_dotenv(_env_path)
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    yield
+    # Release the shared provider connection pool on shutdown
+    await http_client.HTTP.aclose()
 
-class StripApiPrefixMiddleware:
-    def __init__(self, app):
-        self.app = app
-
-    async def __call__(self, scope, receive, send):
-        if scope.get("type") == "http":
-            path = scope.get("path", "")
-            if path == "/api":
-                scope["path"] = "/"
-                scope["raw_path"] = b"/"
-            elif path.startswith("/api/"):
-                new_path = path[len("/api") :]
-                scope["path"] = new_path
-                scope["raw_path"] = new_path.encode("utf-8")
-        await self.app(scope, receive, send)
-
-
-app = FastAPI(title="Dev Interview AI API", version="1.0.0")
-app.add_middleware(StripApiPrefixMiddleware)
+app = FastAPI(title="Dev Interview AI API", version="1.0.0", default_response_class=ORJSONResponse, lifespan=_lifespan)
 logger = logging.getLogger("uvicorn.error")
 
-ai_router = AIRouter()
+ai_router = get_ai_router()
+
+def _ai_generate(**kwargs) -> AIResult:
+    # Sync handlers run in the threadpool; hop back onto the event loop to run the async router
+    return from_thread.run(functools.partial(ai_router.generate, **kwargs))
+
+# Request ids are a per-process random prefix plus a counter: unique enough for log correlation
+_REQ_PREFIX = uuid.uuid4().hex[:8]
+_req_counter = itertools.count(1)
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    request_id = str(uuid.uuid4())
+    request_id = f"{_REQ_PREFIX}-{next(_req_counter):x}"
     request.state.request_id = request_id
     logger.info("[%s] HTTP %s %s", request_id, request.method, request.url.path)
     try:
@@ -95,32 +106,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
+# (epoch second, ISO string) of the last formatted timestamp
+_last_iso: tuple = (0, "")
 
-def _env_int(name: str, default: int) -> int:
-    try:
-        return int(os.environ.get(name, default))
-    except Exception:
-        return int(default)
-
-def _initial_credits() -> int:
-    return _env_int("FREE_TRIAL_CREDITS", _env_int("DEFAULT_CREDITS", 3))
+def now_iso() -> str:
+    # Second resolution is enough for createdAt/updatedAt; reuse the string within a second
+    global _last_iso
+    t = int(time.time())
+    if t != _last_iso[0]:
+        _last_iso = (t, datetime.fromtimestamp(t, tz=timezone.utc).isoformat())
+    return _last_iso[1]
+
+# Account defaults, read once at import
+_DEFAULT_PLAN = os.environ.get("DEFAULT_PLAN", "free")
+_INITIAL_CREDITS = env_int("FREE_TRIAL_CREDITS", env_int("DEFAULT_CREDITS", 3))
+_ALLOW_DEV_CREDITS = os.environ.get("ALLOW_DEV_CREDITS", "false").lower() == "true"
+
+# Interview length bounds (minutes), read once at import
+_MIN_MINUTES = env_int("INTERVIEW_MIN_MINUTES", 10)
+_MAX_MINUTES_FREE = env_int("INTERVIEW_MAX_MINUTES_FREE", 15)
+_MAX_MINUTES_PRO = env_int("INTERVIEW_MAX_MINUTES_PRO", 25)
 
 def _max_minutes_for_plan(plan: Optional[str]) -> int:
-    plan_value = (plan or "free").lower()
-    free_max = _env_int("INTERVIEW_MAX_MINUTES_FREE", 15)
-    pro_max = _env_int("INTERVIEW_MAX_MINUTES_PRO", 25)
-    return pro_max if plan_value == "pro" else free_max
+    return _MAX_MINUTES_PRO if (plan or "free").lower() == "pro" else _MAX_MINUTES_FREE
 
 def _clamp_duration_minutes(config: InterviewConfig) -> int:
-    min_minutes = _env_int("INTERVIEW_MIN_MINUTES", 10)
     max_minutes = _max_minutes_for_plan(config.plan)
     try:
         duration = int(config.duration)
     except Exception:
         duration = max_minutes
-    return max(min_minutes, min(duration, max_minutes))
+    return max(_MIN_MINUTES, min(duration, max_minutes))
 
 def _normalize_config(config: InterviewConfig) -> InterviewConfig:
     duration = _clamp_duration_minutes(config)
@@ -140,6 +156,23 @@ def _plan_question_bounds(duration_min: int) -> tuple[int, int]:
 def health():
     return {"ok": True, "time": now_iso()}
 
+# Shared pool for independent Firestore reads issued by a single request
+_FIRESTORE_POOL = ThreadPoolExecutor(max_workers=10, thread_name_prefix="firestore")
+
+def _email_index_ref(db, email: str):
+    # users_by_email/{sha1(email)} -> {"uid"}: lets the purchase webhook find an account without a query
+    return db.collection("users_by_email").document(hashlib.sha1(email.strip().lower().encode("utf-8")).hexdigest())
+
+def _claim_email_index(db, email: str, uid: str) -> None:
+    # First writer wins: a later account with the same email never takes over its purchases.
+    # Best effort, since _find_user_by_email repairs missing entries
+    try:
+        _email_index_ref(db, email).create({"uid": uid})
+    except AlreadyExists:
+        pass
+    except Exception:
+        logger.exception("Failed to index email for uid=%s", uid)
+
 @app.get("/me", response_model=UserProfile)
 def me(user=Depends(get_current_user)):
     logger.info("GET /me called uid=%s email=%s", user.get("uid"), user.get("email"))
@@ -152,12 +185,16 @@ def me(user=Depends(get_current_user)):
             name=user.get("name") or user.get("email", "UsuÃ¡rio").split("@")[0],
             email=user.get("email", ""),
             avatar=user.get("picture"),
-            credits=_initial_credits(),
+            credits=_INITIAL_CREDITS,
             interviews=[],
         )
 
     try:
-        doc = db.collection("users").document(user["uid"]).get()
+        user_ref = db.collection("users").document(user["uid"])
+        # Profile and last interviews are independent reads, so run them side by side
+        q = user_ref.collection("interviews").order_by("date", direction=firestore.Query.DESCENDING).limit(20)
+        interviews_future = _FIRESTORE_POOL.submit(lambda: [d.to_dict() for d in q.stream()])
+        doc = user_ref.get()
         if not doc.exists:
             profile = {
                 "uid": user["uid"],
@@ -166,22 +203,20 @@ def me(user=Depends(get_current_user)):
                 "email": user.get("email", ""),
                 "avatar": user.get("picture"),
                 "photoURL": user.get("photoURL") or user.get("picture"),
-                "plan": os.environ.get("DEFAULT_PLAN", "free"),
-                "credits": _initial_credits(),
-                "createdAt": now_iso(),
-                "updatedAt": now_iso(),
+                "plan": _DEFAULT_PLAN,
+                "credits": _INITIAL_CREDITS,
+                "createdAt": firestore.SERVER_TIMESTAMP,
+                "updatedAt": firestore.SERVER_TIMESTAMP,
             }
-            db.collection("users").document(user["uid"]).set(profile, merge=True)
+            user_ref.set(profile, merge=True)
+            if profile["email"]:
+                _claim_email_index(db, profile["email"], user["uid"])
             return UserProfile(**profile)
         data = doc.to_dict() or {}
         data.setdefault("uid", user["uid"])
         # fetch last interviews
         try:
-            items = []
-            q = db.collection("users").document(user["uid"]).collection("interviews").order_by("date", direction=firestore.Query.DESCENDING).limit(20)
-            for d in q.stream():
-                items.append(d.to_dict())
-            data["interviews"] = items
+            data["interviews"] = interviews_future.result()
         except Exception:
             data.setdefault("interviews", [])
         return UserProfile(**data)
@@ -192,47 +227,114 @@ def me(user=Depends(get_current_user)):
             name=user.get("name") or user.get("email", "UsuÃ¡rio").split("@")[0],
             email=user.get("email", ""),
             avatar=user.get("picture"),
-            credits=_initial_credits(),
+            credits=_INITIAL_CREDITS,
             interviews=[],
         )
 
 
+# Short-lived per-uid credit balances; writes in this process refresh or drop the entry
+_CREDITS_CACHE = TTLCache(maxsize=4096, ttl=env_int("CREDITS_CACHE_TTL_SECONDS", 3))
+
+
 def _get_user_credits(user_uid: str) -> int:
+    cached = _CREDITS_CACHE.get(user_uid)
+    if cached is not None:
+        return cached
     db = get_firestore_client()
     snap = db.collection("users").document(user_uid).get()
     if not snap.exists:
-        return _initial_credits()
-    return int((snap.to_dict() or {}).get("credits", 0))
+        return _INITIAL_CREDITS
+    credits = int((snap.to_dict() or {}).get("credits", 0))
+    _CREDITS_CACHE.set(user_uid, credits)
+    return credits
 
 
+# Optimistic debit retries when another write lands between the read and the update
+_DEBIT_ATTEMPTS = 5
+
 def _debit_credits(user_uid: str, amount: int = 1) -> int:
     db = get_firestore_client()
     user_ref = db.collection("users").document(user_uid)
 
-    @firestore.transactional
-    def _tx_charge(transaction):
-        snap = user_ref.get(transaction=transaction)
-        if not snap.exists:
-            transaction.set(user_ref, {
-                "uid": user_uid,
-                "displayName": user_uid,
-                "email": "",
-                "plan": os.environ.get("DEFAULT_PLAN", "free"),
-                "credits": _initial_credits(),
-                "createdAt": now_iso(),
-                "updatedAt": now_iso(),
-            }, merge=True)
-            credits = _initial_credits()
-        else:
+    try:
+        for _ in range(_DEBIT_ATTEMPTS):
+            snap = user_ref.get()
+            if not snap.exists:
+                credits = _INITIAL_CREDITS
+                if credits < amount:
+                    raise HTTPException(status_code=402, detail="CrÃ©ditos insuficientes")
+                try:
+                    user_ref.create({
+                        "uid": user_uid,
+                        "displayName": user_uid,
+                        "email": "",
+                        "plan": _DEFAULT_PLAN,
+                        "credits": credits - amount,
+                        "createdAt": firestore.SERVER_TIMESTAMP,
+                        "updatedAt": firestore.SERVER_TIMESTAMP,
+                    })
+                except AlreadyExists:
+                    continue
+                remaining = credits - amount
+                break
+
             credits = int((snap.to_dict() or {}).get("credits", 0))
+            if credits < amount:
+                raise HTTPException(status_code=402, detail="CrÃ©ditos insuficientes")
+            try:
+                # Single write instead of a transaction; the update_time precondition
+                # rejects it if the balance changed after our read
+                user_ref.update(
+                    {"credits": firestore.Increment(-amount), "updatedAt": firestore.SERVER_TIMESTAMP},
+                    option=db.write_option(last_update_time=snap.update_time),
+                )
+            except FailedPrecondition:
+                continue
+            remaining = credits - amount
+            break
+        else:
+            raise HTTPException(status_code=409, detail="Conflito ao debitar creditos. Tente novamente.")
+    except Exception:
+        _CREDITS_CACHE.pop(user_uid)
+        raise
+    _CREDITS_CACHE.set(user_uid, remaining)
+    return remaining
 
-        if credits < amount:
-            raise HTTPException(status_code=402, detail="CrÃ©ditos insuficientes")
 
-        transaction.update(user_ref, {"credits": credits - amount, "updatedAt": now_iso()})
-        return credits - amount
+def _refund_credits(user_uid: str, amount: int = 1) -> None:
+    db = get_firestore_client()
+    db.collection("users").document(user_uid).update(
+        {"credits": firestore.Increment(amount), "updatedAt": firestore.SERVER_TIMESTAMP}
+    )
+    _CREDITS_CACHE.pop(user_uid)
 
-    return _tx_charge(db.transaction())
+
+@contextmanager
+def _charged(user_uid: str, amount: int = 1):
+    # Debit before the AI work (one transaction, 402 when short) and give it back if the work fails
+    remaining = _debit_credits(user_uid, amount=amount)
+    try:
+        yield remaining
+    except BaseException:
+        try:
+            _refund_credits(user_uid, amount=amount)
+        except Exception:
+            logger.exception("Failed to refund %s credit(s) to uid=%s", amount, user_uid)
+        raise
+
+
+@asynccontextmanager
+async def _charged_async(user_uid: str, amount: int = 1):
+    # Same as _charged for async handlers; the Firestore calls run in worker threads
+    remaining = await asyncio.to_thread(_debit_credits, user_uid, amount)
+    try:
+        yield remaining
+    except BaseException:
+        try:
+            await asyncio.to_thread(_refund_credits, user_uid, amount)
+        except Exception:
+            logger.exception("Failed to refund %s credit(s) to uid=%s", amount, user_uid)
+        raise
 
 
 def _handle_ai_error(e: AIProviderError):
@@ -247,106 +349,96 @@ def _handle_ai_error(e: AIProviderError):
     # Surface a generic message to the client but keep logs for operators
     raise HTTPException(status_code=e.status_code or 503, detail="AI indisponÃ­vel. Tente novamente.", headers=headers)
 
+_FENCE_OPEN = re.compile(r"^```[a-zA-Z]*\s*")
+_FENCE_CLOSE = re.compile(r"\s*```$")
+_SPLIT_LIST = re.compile(r"[;\n]")
+
 def _safe_json_loads(text: str):
     if not text:
         return {}
     cleaned = text.strip()
     if cleaned.startswith("```"):
-        cleaned = re.sub(r"^```[a-zA-Z]*\s*", "", cleaned)
-        cleaned = re.sub(r"\s*```$", "", cleaned)
+        cleaned = _FENCE_OPEN.sub("", cleaned)
+        cleaned = _FENCE_CLOSE.sub("", cleaned)
         cleaned = cleaned.strip()
     try:
-        return json.loads(cleaned)
+        return json_utils.loads(cleaned)
     except Exception:
         start = cleaned.find("{")
         end = cleaned.rfind("}")
         if start != -1 and end != -1 and end > start:
             snippet = cleaned[start : end + 1]
-            return json.loads(snippet)
+            return json_utils.loads(snippet)
         raise
 
-def _openai_transcribe_audio(audio_bytes: bytes, mime_type: str) -> str:
+async def _openai_transcribe_audio(audio_bytes: bytes, mime_type: str) -> str:
     api_key = (os.environ.get("OPENAI_API_KEY") or "").strip()
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY nao configurada")
 
     model = (os.environ.get("OPENAI_TRANSCRIBE_MODEL") or "gpt-4o-mini-transcribe").strip()
-    boundary = f"----codexboundary{uuid.uuid4().hex}"
-
-    def _part(name: str, value: str) -> bytes:
-        return (
-            f"--{boundary}\r\n"
-            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
-            f"{value}\r\n"
-        ).encode("utf-8")
-
-    filename = "audio.webm"
-    file_header = (
-        f"--{boundary}\r\n"
-        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
-        f"Content-Type: {mime_type}\r\n\r\n"
-    ).encode("utf-8")
-    file_footer = b"\r\n"
-
-    body = b"".join([
-        _part("model", model),
-        file_header,
-        audio_bytes,
-        file_footer,
-        f"--{boundary}--\r\n".encode("utf-8"),
-    ])
-
-    req = urllib.request.Request(
-        "https://api.openai.com/v1/audio/transcriptions",
-        data=body,
-        headers={
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": f"multipart/form-data; boundary={boundary}",
-        },
-        method="POST",
-    )
-
     try:
-        with urllib.request.urlopen(req, timeout=60) as resp:
-            raw = resp.read().decode("utf-8", errors="ignore")
-    except urllib.error.HTTPError as e:
-        body = e.read().decode("utf-8", errors="ignore")
-        raise RuntimeError(f"OpenAI transcribe error: {e.code} {body}") from e
+        resp = await _OPENAI_HTTP.post(
+            "/audio/transcriptions",
+            headers={"Authorization": f"Bearer {api_key}"},
+            data={"model": model},
+            files={"file": ("audio.webm", audio_bytes, mime_type)},
+            timeout=60.0,
+        )
+        resp.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        body = e.response.content.decode("utf-8", errors="ignore")
+        raise RuntimeError(f"OpenAI transcribe error: {e.response.status_code} {body}") from e
 
+    raw = resp.content
     try:
-        data = json.loads(raw)
+        data = json_utils.loads(raw)
         return (data.get("text") or "").strip()
     except Exception:
-        return raw.strip()
+        return raw.decode("utf-8", errors="ignore").strip()
 
-def _build_plan_prompt_strict(config: InterviewConfig) -> str:
-    duration = _clamp_duration_minutes(config)
-    min_q, max_q = _plan_question_bounds(duration)
-    return f"""
+_PLAN_STRICT_SYSTEM_PROMPT = """
 Voce e um entrevistador de engenharia de software.
 Retorne SOMENTE um JSON valido, sem markdown e sem texto extra.
 
 Formato EXATO:
-{{
+{
   "roleTitleGuess": "string",
   "seniorityGuess": "string",
   "mustHaveSkills": ["skill1","skill2"],
-  "blueprint": {{"hr": 20, "technical": 45, "design": 20, "behavioral": 15}},
+  "blueprint": {"hr": 20, "technical": 45, "design": 20, "behavioral": 15},
   "questions": [
-    {{"id":"q1","section":"technical","difficulty":3,"prompt":"..."}}
+    {"id":"q1","section":"technical","difficulty":3,"prompt":"..."}
   ]
-}}
-
-Config: {config.model_dump()}
+}
 
 Regras:
-- Idioma das perguntas: {config.interviewLanguage}
 - Se existir jobDescription, adapte perguntas para ela
-- Dificuldade deve refletir {config.seniority}
+"""
+
+# Both plan prompts share this tail; only the system prompt differs between them
+_PLAN_PROMPT_TEMPLATE = """
+Config: {config_json}
+
+Regras:
+- Idioma das perguntas: {language}
+- Dificuldade deve refletir {seniority}
 - DuraÃ§Ã£o alvo: {duration} minutos
 - questions: {min_q} a {max_q} perguntas
 """
 
+def _build_plan_prompt(config: InterviewConfig) -> str:
+    duration = _clamp_duration_minutes(config)
+    min_q, max_q = _plan_question_bounds(duration)
+    return _PLAN_PROMPT_TEMPLATE.format(
+        config_json=config.config_json,
+        language=config.interviewLanguage,
+        seniority=config.seniority,
+        duration=duration,
+        min_q=min_q,
+        max_q=max_q,
+    )
+
 def _parse_plan_payload(payload: dict, config: InterviewConfig) -> Optional[InterviewPlan]:
     if not isinstance(payload, dict):
         return None
@@ -397,76 +489,87 @@ def _parse_plan_payload(payload: dict, config: InterviewConfig) -> Optional[Inte
         questions=questions,
     )
 
-def _build_plan_prompt(config: InterviewConfig) -> str:
-    duration = _clamp_duration_minutes(config)
-    min_q, max_q = _plan_question_bounds(duration)
-    return f"""
+_PLAN_SYSTEM_PROMPT = """
 Voce e um entrevistador de engenharia de software.
-Gere um plano de entrevista (estruturado) a partir da configuracao:
-
-Config: {config.model_dump()}
+Gere um plano de entrevista (estruturado) a partir da configuracao fornecida.
 
 Regras:
-- Idioma das perguntas: {config.interviewLanguage}
 - Se existir jobDescription, adapte perguntas para ela
-- Dificuldade deve refletir {config.seniority}
 - blueprint: percentuais 0-100 para secoes (hr, technical, design, behavioral) somando ~100
-- DuraÃ§Ã£o alvo: {duration} minutos
-- questions: {min_q} a {max_q} perguntas, cada uma com id, section, difficulty (1-5), prompt
+- questions: cada uma com id, section, difficulty (1-5), prompt
 Retorne somente JSON, sem markdown e sem texto extra.
 """
 
 
-def _build_eval_prompt(config: InterviewConfig, question: str, confirmed_name: str, transcript: Optional[str] = None) -> str:
-    tasks = """
+_EVAL_SYSTEM_PROMPT = """
+Voce e um entrevistador tecnico.
+
+Formato EXATO:
+{
+  "transcript": "string",
+  "scores": {"communication": 0, "technical": 0, "problemSolving": 0, "presence": 0},
+  "strengths": ["..."],
+  "improvements": ["..."],
+  "followUpNeeded": false,
+  "followUpQuestion": null
+}
+
+Regras:
+- Retorne somente JSON valido, sem markdown e sem texto extra.
+- Sempre inclua o campo transcript (use \\n para quebras de linha).
+- Se followUpNeeded=false, followUpQuestion deve ser null.
+"""
+
+_EVAL_TASKS_AUDIO = """
 Tarefas:
 1) Transcreva a resposta do audio.
 2) Avalie a resposta do {name} em: communication, technical, problemSolving, presence (0-10).
 3) Liste 2-5 strengths e 2-5 improvements.
 4) Se a resposta foi rasa, indique followUpNeeded=true e proponha followUpQuestion (1 pergunta objetiva).
-""".format(name=confirmed_name)
+"""
 
-    transcript_block = ""
-    if transcript:
-        tasks = """
+_EVAL_TASKS_TRANSCRIPT = """
 Tarefas:
 1) Use a transcricao fornecida (nao transcreva novamente).
 2) Avalie a resposta do {name} em: communication, technical, problemSolving, presence (0-10).
 3) Liste 2-5 strengths e 2-5 improvements.
 4) Se a resposta foi rasa, indique followUpNeeded=true e proponha followUpQuestion (1 pergunta objetiva).
-""".format(name=confirmed_name)
-        transcript_block = f"""
+"""
+
+_EVAL_TRANSCRIPT_BLOCK = """
 Transcricao fornecida (copie exatamente para o campo transcript):
 \"\"\"{transcript}\"\"\"
 """
 
-    return f"""
-Voce e um entrevistador tecnico.
+_EVAL_PROMPT_TEMPLATE = """
 Pergunta: {question}
-Senioridade alvo: {config.seniority}
-Trilha: {config.track}
-Stacks: {", ".join(config.stacks)}
-Idioma da entrevista: {config.interviewLanguage}
+Senioridade alvo: {seniority}
+Trilha: {track}
+Stacks: {stacks}
+Idioma da entrevista: {language}
 
 {tasks}
 {transcript_block}
-
-Formato EXATO:
-{{
-  "transcript": "string",
-  "scores": {{"communication": 0, "technical": 0, "problemSolving": 0, "presence": 0}},
-  "strengths": ["..."],
-  "improvements": ["..."],
-  "followUpNeeded": false,
-  "followUpQuestion": null
-}}
-
-Regras:
-- Retorne somente JSON valido, sem markdown e sem texto extra.
-- Sempre inclua o campo transcript (use \\n para quebras de linha).
-- Se followUpNeeded=false, followUpQuestion deve ser null.
 """
 
+def _build_eval_prompt(config: InterviewConfig, question: str, confirmed_name: str, transcript: Optional[str] = None) -> str:
+    if transcript:
+        tasks = _EVAL_TASKS_TRANSCRIPT.format(name=confirmed_name)
+        transcript_block = _EVAL_TRANSCRIPT_BLOCK.format(transcript=transcript)
+    else:
+        tasks = _EVAL_TASKS_AUDIO.format(name=confirmed_name)
+        transcript_block = ""
+
+    return _EVAL_PROMPT_TEMPLATE.format(
+        question=question,
+        seniority=config.seniority,
+        track=config.track,
+        stacks=", ".join(config.stacks),
+        language=config.interviewLanguage,
+        tasks=tasks,
+        transcript_block=transcript_block,
+    )
+
 
 def _normalize_eval_payload(payload: dict, transcript_fallback: Optional[str] = None) -> dict:
     if not isinstance(payload, dict):
@@ -509,7 +612,7 @@ def _normalize_eval_payload(payload: dict, transcript_fallback: Optional[str] =
     for key in ("strengths", "improvements"):
         val = payload.get(key)
         if isinstance(val, str):
-            items = [v.strip() for v in re.split(r"[;\n]", val) if v.strip()]
+            items = [v.strip() for v in _SPLIT_LIST.split(val) if v.strip()]
             payload[key] = items
         elif val is None:
             payload[key] = []
@@ -527,27 +630,32 @@ def _normalize_eval_payload(payload: dict, transcript_fallback: Optional[str] =
     return payload
 
 
-def _build_report_prompt(config: InterviewConfig, history: list) -> str:
-    return f"""
+_REPORT_SYSTEM_PROMPT = """
 Analise o historico completo da entrevista e gere um relatorio final.
 
-Config: {config.model_dump()}
-Historico: {history}
-
 Retorne somente JSON, sem markdown e sem texto extra. Campos:
 - overallScore (0-10)
 - levelEstimate (string)
-- jobMatch: {{ covered: [..], gaps: [..] }}
-- feedback: {{ posture: [..], communication: [..], technical: [..], language: [..] }}
+- jobMatch: { covered: [..], gaps: [..] }
+- feedback: { posture: [..], communication: [..], technical: [..], language: [..] }
 - plan7Days: lista de 7 itens (day: 1-7, task: string)
 """
 
+def _build_report_prompt(config: InterviewConfig, history: list) -> str:
+    return f"""
+Config: {config.config_json}
+Historico: {history}
+"""
+
+
+_SCORE_KEYS = ("communication", "technical", "problemSolving", "presence")
 
 def _summarize_scores(history: list) -> Optional[tuple[AnswerScores, float]]:
     if not isinstance(history, list):
         return None
-    sums = {"communication": 0.0, "technical": 0.0, "problemSolving": 0.0, "presence": 0.0}
-    counts = {"communication": 0, "technical": 0, "problemSolving": 0, "presence": 0}
+    # Positional accumulators indexed like _SCORE_KEYS; one pass over history
+    sums = [0.0, 0.0, 0.0, 0.0]
+    counts = [0, 0, 0, 0]
 
     for item in history:
         if not isinstance(item, dict):
@@ -558,25 +666,24 @@ def _summarize_scores(history: list) -> Optional[tuple[AnswerScores, float]]:
         scores = evaluation.get("scores") if isinstance(evaluation.get("scores"), dict) else evaluation
         if not isinstance(scores, dict):
             continue
-        for key in sums.keys():
+        for i, key in enumerate(_SCORE_KEYS):
             val = scores.get(key)
+            if val is None:
+                continue
             try:
                 val = float(val)
-            except Exception:
+            except (TypeError, ValueError):
                 continue
-            sums[key] += val
-            counts[key] += 1
+            sums[i] += val
+            counts[i] += 1
 
-    if not any(counts.values()):
+    if not any(counts):
         return None
 
-    avg = {}
-    for key in sums.keys():
-        if counts[key] > 0:
-            avg[key] = round(sums[key] / counts[key], 2)
-        else:
-            avg[key] = 0.0
-
+    avg = {
+        key: round(sums[i] / counts[i], 2) if counts[i] else 0.0
+        for i, key in enumerate(_SCORE_KEYS)
+    }
     overall = round(sum(avg.values()) / len(avg), 2)
     return AnswerScores(**avg), overall
 
@@ -598,12 +705,12 @@ def start_session(config: InterviewConfig, user=Depends(get_current_user)):
                 "email": user.get("email", ""),
                 "avatar": user.get("picture"),
                 "photoURL": user.get("photoURL") or user.get("picture"),
-                "plan": os.environ.get("DEFAULT_PLAN", "free"),
-                "credits": _initial_credits(),
-                "createdAt": now_iso(),
-                "updatedAt": now_iso(),
+                "plan": _DEFAULT_PLAN,
+                "credits": _INITIAL_CREDITS,
+                "createdAt": firestore.SERVER_TIMESTAMP,
+                "updatedAt": firestore.SERVER_TIMESTAMP,
             }, merge=True)
-            credits = _initial_credits()
+            credits = _INITIAL_CREDITS
         else:
             credits = int((snap.to_dict() or {}).get("credits", 0))
 
@@ -613,30 +720,39 @@ def start_session(config: InterviewConfig, user=Depends(get_current_user)):
             "status": "started",
             "plan_status": "pending",
             "config": config.model_dump(),
-            "createdAt": now_iso(),
-            "updatedAt": now_iso(),
+            "createdAt": firestore.SERVER_TIMESTAMP,
+            "updatedAt": firestore.SERVER_TIMESTAMP,
         })
-        return session_ref.id, credits
+        return session_ref.id, credits, not snap.exists
 
     try:
-        session_id, credits = _tx_create(db.transaction())
+        session_id, credits, created = _tx_create(db.transaction())
     except Exception as e:
         logger.exception("start_session transaction failed")
         raise HTTPException(status_code=500, detail="Falha ao iniciar sessao")
+    if created and user.get("email"):
+        _claim_email_index(db, user["email"], user["uid"])
+    _CREDITS_CACHE.set(user["uid"], credits)
 
     return SessionStartResponse(sessionId=session_id, plan=None, plan_status="pending", credits=credits)
 
 
+# Generated plans by session id, so client retries of /plan/generate skip the Firestore read
+_SESSION_PLAN_CACHE = TTLCache(maxsize=1024, ttl=60)
+
 @app.post("/sessions/{session_id}/plan/generate", response_model=PlanGenerateResponse)
 def generate_plan(session_id: str, user=Depends(get_current_user)):
     db = get_firestore_client()
     ref = db.collection("sessions").document(session_id)
-    snap = ref.get()
-    if not snap.exists or (snap.to_dict() or {}).get("uid") != user["uid"]:
-        raise HTTPException(status_code=404, detail="Sessao nao encontrada")
+    data = _SESSION_PLAN_CACHE.get(session_id)
+    if data is None or data.get("uid") != user["uid"]:
+        snap = ref.get()
+        data = snap.to_dict() or {}
+        if not snap.exists or data.get("uid") != user["uid"]:
+            raise HTTPException(status_code=404, detail="Sessao nao encontrada")
 
-    data = snap.to_dict() or {}
     if data.get("plan"):
+        _SESSION_PLAN_CACHE.set(session_id, data)
         plan = InterviewPlan(**data.get("plan"))
         return PlanGenerateResponse(
             sessionId=session_id,
@@ -649,17 +765,21 @@ def generate_plan(session_id: str, user=Depends(get_current_user)):
             credits=_get_user_credits(user["uid"]),
         )
 
-    credits = _get_user_credits(user["uid"])
-    if credits <= 0:
+    # The plan is only charged once it exists, in the same commit that stores it
+    user_ref = db.collection("users").document(user["uid"])
+    user_snap = user_ref.get()
+    credits = int((user_snap.to_dict() or {}).get("credits", 0)) if user_snap.exists else _INITIAL_CREDITS
+    if credits < 1:
         raise HTTPException(status_code=402, detail="Creditos insuficientes")
 
     config = InterviewConfig(**data.get("config"))
     prompt = _build_plan_prompt(config)
 
     try:
-        result = ai_router.generate(
+        result = _ai_generate(
             task_name="plan",
             prompt=prompt,
+            system_prompt=_PLAN_SYSTEM_PROMPT,
             max_tokens=800,
             temperature=0.2,
             response_mime_type="application/json",
@@ -676,9 +796,11 @@ def generate_plan(session_id: str, user=Depends(get_current_user)):
         logger.warning("Invalid plan payload from AI (provider=%s model=%s)", result.provider_used, result.model_used)
         # Retry once with stricter prompt
         try:
-            retry_result = ai_router.generate(
+            retry_result = _ai_generate(
                 task_name="plan",
-                prompt=_build_plan_prompt_strict(config),
+                # Same user prompt; only the system prompt is stricter
+                prompt=_build_plan_prompt(config),
+                system_prompt=_PLAN_STRICT_SYSTEM_PROMPT,
                 max_tokens=900,
                 temperature=0.1,
                 response_mime_type="application/json",
@@ -692,21 +814,38 @@ def generate_plan(session_id: str, user=Depends(get_current_user)):
             _handle_ai_error(e)
         except Exception:
             raise HTTPException(status_code=503, detail="AI retornou resposta invalida")
-
-    new_credits = _debit_credits(user["uid"], amount=1)
-
-    ref.set(
-        {
-            "plan": plan.model_dump(),
-            "plan_status": "completed",
-            "provider_used": result.provider_used,
-            "model_used": result.model_used,
-            "latency_ms": result.latency_ms,
-            "tokens_used": result.tokens_used,
-            "updatedAt": now_iso(),
-        },
-        merge=True,
-    )
+    # Only a plan that parsed is worth replaying for the next identical prompt
+    ai_router.cache_result(result)
+
+    plan_fields = {
+        "plan": plan.model_dump(),
+        "plan_status": "completed",
+        "provider_used": result.provider_used,
+        "model_used": result.model_used,
+        "latency_ms": result.latency_ms,
+        "tokens_used": result.tokens_used,
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    }
+    new_credits = None
+    if user_snap.exists:
+        batch = db.batch()
+        batch.set(ref, plan_fields, merge=True)
+        batch.update(
+            user_ref,
+            {"credits": firestore.Increment(-1), "updatedAt": firestore.SERVER_TIMESTAMP},
+            option=db.write_option(last_update_time=user_snap.update_time),
+        )
+        try:
+            batch.commit()
+            new_credits = credits - 1
+            _CREDITS_CACHE.set(user["uid"], new_credits)
+        except FailedPrecondition:
+            pass
+    if new_credits is None:
+        # Balance moved since the read (or the user doc is new): debit on its own, then store the plan
+        new_credits = _debit_credits(user["uid"], amount=1)
+        ref.set(plan_fields, merge=True)
+    _SESSION_PLAN_CACHE.set(session_id, {**data, **plan_fields})
 
     return PlanGenerateResponse(
         sessionId=session_id,
@@ -720,27 +859,33 @@ def generate_plan(session_id: str, user=Depends(get_current_user)):
     )
 
 
-@app.post("/ai/name-extract")
-def name_extract(payload: NameExtractRequest, user=Depends(get_current_user)):
-    audio_bytes = _b64_to_bytes(payload.audioBase64)
-    prompt = f"Extraia apenas o primeiro nome da pessoa do audio. Responda somente o nome (1 palavra). Idioma: {payload.uiLanguage}"
+# Extracted names by audio digest, so re-sending the same recording skips the AI call
+_NAME_CACHE = TTLCache(maxsize=4096, ttl=env_int("NAME_CACHE_TTL_SECONDS", 3600))
+
+async def _extract_name(audio_bytes: bytes, mime_type: str, ui_language: str) -> dict:
+    cache_key = (hashlib.blake2b(audio_bytes, digest_size=16).hexdigest(), ui_language)
+    cached = _NAME_CACHE.get(cache_key)
+    if cached is not None:
+        return {"name": cached}
+
+    prompt = f"Extraia apenas o primeiro nome da pessoa do audio. Responda somente o nome (1 palavra). Idioma: {ui_language}"
     try:
-        result = ai_router.generate(
+        result = await ai_router.generate(
             task_name="evaluate",
             prompt=prompt,
             max_tokens=20,
             temperature=0.0,
-            media=[{"data": audio_bytes, "mime_type": payload.mimeType}],
+            media=[{"data": audio_bytes, "mime_type": mime_type}],
         )
     except AIProviderError as e:
         # Fallback: transcribe with OpenAI and extract name from text
         try:
-            transcript = _openai_transcribe_audio(audio_bytes, payload.mimeType)
+            transcript = await _openai_transcribe_audio(audio_bytes, mime_type)
             prompt_txt = (
                 f"Transcrição: {transcript}\n"
-                f"Extraia apenas o primeiro nome da pessoa. Responda somente o nome (1 palavra). Idioma: {payload.uiLanguage}"
+                f"Extraia apenas o primeiro nome da pessoa. Responda somente o nome (1 palavra). Idioma: {ui_language}"
             )
-            result = ai_router.generate(
+            result = await ai_router.generate(
                 task_name="evaluate",
                 prompt=prompt_txt,
                 max_tokens=20,
@@ -750,7 +895,26 @@ def name_extract(payload: NameExtractRequest, user=Depends(get_current_user)):
             _handle_ai_error(e)
 
     name = (result.output_text or "").strip().split()
-    return {"name": name[0] if name else "Candidato"}
+    if not name:
+        return {"name": "Candidato"}
+    _NAME_CACHE.set(cache_key, name[0])
+    return {"name": name[0]}
+
+
+@app.post("/ai/name-extract")
+async def name_extract(payload: NameExtractRequest, user=Depends(get_current_user)):
+    audio_bytes = await asyncio.to_thread(_b64_to_bytes, payload.audioBase64)
+    return await _extract_name(audio_bytes, payload.mimeType, payload.uiLanguage)
+
+
+@app.post("/ai/name-extract/upload")
+async def name_extract_upload(
+    file: UploadFile = File(...),
+    uiLanguage: str = Form("pt-BR"),
+    user=Depends(get_current_user),
+):
+    # Multipart variant: the audio arrives as raw bytes, no base64 inflate/decode
+    return await _extract_name(await file.read(), file.content_type or "audio/webm", uiLanguage)
 
 
 @app.post("/ai/plan", response_model=SessionStartResponse)
@@ -759,8 +923,8 @@ def api_ai_plan(config: InterviewConfig, user=Depends(get_current_user)):
 
 
 @app.post("/ai/evaluate", response_model=AnswerEvaluation)
-def api_ai_evaluate(payload: EvaluateAudioRequest, user=Depends(get_current_user)):
-    return evaluate_audio(payload, user)
+async def api_ai_evaluate(payload: EvaluateAudioRequest, user=Depends(get_current_user)):
+    return await evaluate_audio(payload, user)
 
 
 @app.post("/ai/report", response_model=FinalReport)
@@ -769,126 +933,178 @@ def api_ai_report(payload: FinalReportRequest, user=Depends(get_current_user)):
 
 
 @app.post("/ai/tts")
-def api_tts(body: dict, user=Depends(get_current_user)):
+async def api_tts(body: dict, user=Depends(get_current_user)):
     text = body.get("text")
     if not text:
         raise HTTPException(status_code=400, detail="Missing text")
     language = body.get("language", "pt-BR")
     voice = body.get("voice")
     try:
-        audio = tts_module.synthesize_text(text=text, language_code=language, voice_name=voice)
+        audio = await tts_module.synthesize_text(text=text, language_code=language, voice_name=voice)
         b64 = base64.b64encode(audio).decode()
-        fmt = (os.environ.get("OPENAI_TTS_FORMAT") or "mp3").lower().strip()
-        if fmt in ("wav", "wave"):
-            mime = "audio/wav"
-        elif fmt in ("ogg", "opus"):
-            mime = "audio/ogg"
-        else:
-            mime = "audio/mpeg"
-        return {"audioBase64": b64, "mimeType": mime}
+        return {"audioBase64": b64, "mimeType": tts_module.AUDIO_MIME_TYPE}
     except Exception:
         logger.exception("TTS synth failed")
         raise HTTPException(status_code=503, detail="TTS service unavailable")
 
 
-@app.post("/ai/evaluate-audio", response_model=AnswerEvaluation)
-def evaluate_audio(payload: EvaluateAudioRequest, user=Depends(get_current_user)):
-    if _get_user_credits(user["uid"]) <= 0:
-        raise HTTPException(status_code=402, detail="Creditos insuficientes")
+# Start the OpenAI transcription alongside the audio evaluation so a failed primary
+# call does not pay for a full transcription round-trip afterwards (costs one extra
+# transcription per answer, hence opt-in)
+_SPECULATIVE_TRANSCRIBE = os.environ.get("EVAL_SPECULATIVE_TRANSCRIBE", "false").lower() == "true"
 
-    audio_bytes = _b64_to_bytes(payload.audioBase64)
+async def _evaluate_audio(
+    user_uid: str,
+    config: InterviewConfig,
+    question: str,
+    audio_bytes: bytes,
+    mime_type: str,
+    confirmed_name: Optional[str] = None,
+) -> AnswerEvaluation:
     transcript_fallback = None
-    prompt = _build_eval_prompt(payload.config, payload.question, payload.confirmedName or "o candidato")
-
-    try:
-        result = ai_router.generate(
-            task_name="evaluate",
-            prompt=prompt,
-            max_tokens=400,
-            temperature=0.2,
-            response_mime_type="application/json",
-            media=[{"data": audio_bytes, "mime_type": payload.mimeType}],
-        )
-    except AIProviderError as e:
-        # Fallback: transcribe with OpenAI and evaluate from text
+    prompt = _build_eval_prompt(config, question, confirmed_name or "o candidato")
+
+    async with _charged_async(user_uid):
+        transcribe_task = None
+        if _SPECULATIVE_TRANSCRIBE:
+            transcribe_task = asyncio.create_task(_openai_transcribe_audio(audio_bytes, mime_type))
+            # Mark a failure as retrieved when the primary call succeeds and nobody awaits the task
+            transcribe_task.add_done_callback(lambda t: t.cancelled() or t.exception())
         try:
-            transcript_fallback = _openai_transcribe_audio(audio_bytes, payload.mimeType)
-            prompt_txt = _build_eval_prompt(
-                payload.config,
-                payload.question,
-                payload.confirmedName or "o candidato",
-                transcript=transcript_fallback,
-            )
-            result = ai_router.generate(
+            result = await ai_router.generate(
                 task_name="evaluate",
-                prompt=prompt_txt,
+                prompt=prompt,
+                system_prompt=_EVAL_SYSTEM_PROMPT,
                 max_tokens=400,
                 temperature=0.2,
                 response_mime_type="application/json",
+                media=[{"data": audio_bytes, "mime_type": mime_type}],
             )
-        except Exception:
-            _handle_ai_error(e)
+        except AIProviderError as e:
+            # Fallback: transcribe with OpenAI and evaluate from text
+            try:
+                if transcribe_task is not None:
+                    transcript_fallback = await transcribe_task
+                else:
+                    transcript_fallback = await _openai_transcribe_audio(audio_bytes, mime_type)
+                prompt_txt = _build_eval_prompt(
+                    config,
+                    question,
+                    confirmed_name or "o candidato",
+                    transcript=transcript_fallback,
+                )
+                result = await ai_router.generate(
+                    task_name="evaluate",
+                    prompt=prompt_txt,
+                    system_prompt=_EVAL_SYSTEM_PROMPT,
+                    max_tokens=400,
+                    temperature=0.2,
+                    response_mime_type="application/json",
+                )
+            except Exception:
+                _handle_ai_error(e)
+        finally:
+            if transcribe_task is not None and not transcribe_task.done():
+                transcribe_task.cancel()
 
-    try:
-        data = _safe_json_loads(result.output_text or "{}")
-        data = _normalize_eval_payload(data, transcript_fallback=transcript_fallback)
-        evaluation = AnswerEvaluation(**data)
-    except Exception:
         try:
-            logger.warning("Invalid AI evaluation payload (provider=%s model=%s)", result.provider_used, result.model_used)
+            data = _safe_json_loads(result.output_text or "{}")
+            data = _normalize_eval_payload(data, transcript_fallback=transcript_fallback)
+            evaluation = AnswerEvaluation.model_validate(data)
         except Exception:
-            pass
-        raise HTTPException(status_code=503, detail="AI retornou resposta invalida")
+            try:
+                logger.warning("Invalid AI evaluation payload (provider=%s model=%s)", result.provider_used, result.model_used)
+            except Exception:
+                pass
+            raise HTTPException(status_code=503, detail="AI retornou resposta invalida")
 
-    _debit_credits(user["uid"], amount=1)
     return evaluation
 
 
+@app.post("/ai/evaluate-audio", response_model=AnswerEvaluation)
+async def evaluate_audio(payload: EvaluateAudioRequest, user=Depends(get_current_user)):
+    audio_bytes = await asyncio.to_thread(_b64_to_bytes, payload.audioBase64)
+    return await _evaluate_audio(
+        user["uid"],
+        payload.config,
+        payload.question,
+        audio_bytes,
+        payload.mimeType,
+        payload.confirmedName,
+    )
+
+
+@app.post("/ai/evaluate-audio/upload", response_model=AnswerEvaluation)
+async def evaluate_audio_upload(
+    file: UploadFile = File(...),
+    config: str = Form(...),
+    question: str = Form(...),
+    confirmedName: Optional[str] = Form(None),
+    user=Depends(get_current_user),
+):
+    # Multipart variant: config travels as a JSON form field, the audio as raw bytes
+    try:
+        interview_config = InterviewConfig.model_validate_json(config)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="config invalido")
+    return await _evaluate_audio(
+        user["uid"],
+        interview_config,
+        question,
+        await file.read(),
+        file.content_type or "audio/webm",
+        confirmedName,
+    )
+
+
 @app.post("/ai/final-report", response_model=FinalReport)
 def final_report(payload: FinalReportRequest, user=Depends(get_current_user)):
-    if _get_user_credits(user["uid"]) <= 0:
-        raise HTTPException(status_code=402, detail="Creditos insuficientes")
-
     prompt = _build_report_prompt(payload.config, payload.history)
     summary = _summarize_scores(payload.history)
-    try:
-        result = ai_router.generate(
-            task_name="report",
-            prompt=prompt,
-            max_tokens=1200,
-            temperature=0.2,
-            response_mime_type="application/json",
-        )
-    except AIProviderError as e:
-        _handle_ai_error(e)
 
-    try:
-        data = _safe_json_loads(result.output_text or "{}")
-        report = FinalReport(**data)
-        if summary:
-            scores_summary, overall = summary
-            report_data = report.model_dump()
-            report_data["scoresSummary"] = scores_summary.model_dump()
-            report_data["overallScore"] = overall
-            report = FinalReport(**report_data)
-    except Exception:
-        raise HTTPException(status_code=503, detail="AI retornou resposta invalida")
+    with _charged(user["uid"]):
+        try:
+            result = _ai_generate(
+                task_name="report",
+                prompt=prompt,
+                system_prompt=_REPORT_SYSTEM_PROMPT,
+                max_tokens=1200,
+                temperature=0.2,
+                response_mime_type="application/json",
+            )
+        except AIProviderError as e:
+            _handle_ai_error(e)
+
+        try:
+            data = _safe_json_loads(result.output_text or "{}")
+            if summary:
+                # Attach the computed scores before the single validation pass
+                data["scoresSummary"], data["overallScore"] = summary
+            report = FinalReport.model_validate(data)
+            ai_router.cache_result(result)
+        except Exception:
+            raise HTTPException(status_code=503, detail="AI retornou resposta invalida")
 
-    _debit_credits(user["uid"], amount=1)
     return report
 
 
+# Constant parts of the finish writes; only the report, meta and history entry vary per call
+_FINISH_USER_FIELDS = {"updatedAt": firestore.SERVER_TIMESTAMP, "lastInterviewAt": firestore.SERVER_TIMESTAMP}
+_FINISH_SESSION_FIELDS = {"status": "finished", "updatedAt": firestore.SERVER_TIMESTAMP, "finishedAt": firestore.SERVER_TIMESTAMP}
+
 @app.post("/sessions/{session_id}/finish")
 def finish_session(session_id: str, payload: SessionFinishRequest, user=Depends(get_current_user)):
     db = get_firestore_client()
     ref = db.collection("sessions").document(session_id)
     snap = ref.get()
-    if not snap.exists or (snap.to_dict() or {}).get("uid") != user["uid"]:
+    data = snap.to_dict() or {}
+    if not snap.exists or data.get("uid") != user["uid"]:
         raise HTTPException(status_code=404, detail="Sessao nao encontrada")
+    _SESSION_PLAN_CACHE.pop(session_id)
 
     report = payload.report
-    plan = (snap.to_dict() or {}).get("plan", {}) or {}
-    config = (snap.to_dict() or {}).get("config", {}) or {}
+    plan = data.get("plan", {}) or {}
+    config = data.get("config", {}) or {}
 
     history_item = {
         "id": session_id,
@@ -899,17 +1115,13 @@ def finish_session(session_id: str, payload: SessionFinishRequest, user=Depends(
         "track": config.get("track", ""),
     }
 
+    # User stamp, history entry and session result land in one commit
     user_ref = db.collection("users").document(user["uid"])
-    user_ref.set({"updatedAt": now_iso(), "lastInterviewAt": now_iso()}, merge=True)
-    user_ref.collection("interviews").document(session_id).set(history_item, merge=True)
-
-    ref.set({
-        "status": "finished",
-        "report": report.model_dump(),
-        "meta": payload.meta,
-        "updatedAt": now_iso(),
-        "finishedAt": now_iso(),
-    }, merge=True)
+    batch = db.batch()
+    batch.set(user_ref, _FINISH_USER_FIELDS, merge=True)
+    batch.set(user_ref.collection("interviews").document(session_id), history_item, merge=True)
+    batch.set(ref, {**_FINISH_SESSION_FIELDS, "report": report.model_dump(), "meta": payload.meta}, merge=True)
+    batch.commit()
 
     return {"ok": True}
 
@@ -925,6 +1137,7 @@ def delete_session(session_id: str, user=Depends(get_current_user)):
 
     if snap.exists:
         session_ref.delete()
+    _SESSION_PLAN_CACHE.pop(session_id)
 
     user_ref = db.collection("users").document(user["uid"])
     user_ref.collection("interviews").document(session_id).delete()
@@ -933,7 +1146,7 @@ def delete_session(session_id: str, user=Depends(get_current_user)):
 
 @app.post("/credits/dev-add")
 def dev_add_credits(amount: int = 3, user=Depends(get_current_user)):
-    if os.environ.get("ALLOW_DEV_CREDITS", "false").lower() != "true":
+    if not _ALLOW_DEV_CREDITS:
         raise HTTPException(status_code=403, detail="Desabilitado")
     if amount <= 0 or amount > 1000:
         raise HTTPException(status_code=400, detail="amount invalido")
@@ -942,22 +1155,51 @@ def dev_add_credits(amount: int = 3, user=Depends(get_current_user)):
     ref = db.collection("users").document(user["uid"])
     snap = ref.get()
     current = int((snap.to_dict() or {}).get("credits", 0)) if snap.exists else 0
-    ref.set({"credits": current + int(amount), "updatedAt": now_iso()}, merge=True)
+    ref.set({"credits": current + int(amount), "updatedAt": firestore.SERVER_TIMESTAMP}, merge=True)
+    _CREDITS_CACHE.pop(user["uid"])
     return {"credits": current + int(amount)}
 
 
 def _b64_to_bytes(b64: str) -> bytes:
-    if "," in b64:
-        b64 = b64.split(",", 1)[1]
-    pad = "=" * (-len(b64) % 4)
-    return base64.b64decode(b64 + pad)
+    # Strip a data: URL prefix; only copy the (possibly multi-MB) string when padding is missing
+    i = b64.find(",")
+    if i >= 0:
+        b64 = b64[i + 1:]
+    rem = len(b64) & 3
+    if rem:
+        b64 += "=" * (4 - rem)
+    return binascii.a2b_base64(b64)
 
 
 # Kiwify webhook helpers
 
-def _get_nested(d: dict, path: str):
+# Candidate payload locations, split into key tuples once at import
+_EMAIL_PATHS = tuple(tuple(p.split(".")) for p in (
+    "email",
+    "customer.email",
+    "buyer.email",
+    "client.email",
+    "user.email",
+))
+_PRODUCT_KEY_PATHS = tuple(tuple(p.split(".")) for p in (
+    "product_id",
+    "product.id",
+    "product",
+    "product_name",
+    "product.name",
+    "offer.name",
+))
+_EVENT_ID_PATHS = tuple(tuple(p.split(".")) for p in (
+    "transaction_id",
+    "order_id",
+    "id",
+    "event_id",
+))
+
+
+def _get_nested(d: dict, keys: tuple):
     cur = d
-    for key in path.split("."):
+    for key in keys:
         if not isinstance(cur, dict) or key not in cur:
             return None
         cur = cur[key]
@@ -965,45 +1207,24 @@ def _get_nested(d: dict, path: str):
 
 
 def _extract_email(payload: dict) -> str | None:
-    candidates = [
-        "email",
-        "customer.email",
-        "buyer.email",
-        "client.email",
-        "user.email",
-    ]
-    for path in candidates:
-        val = _get_nested(payload, path)
+    for keys in _EMAIL_PATHS:
+        val = _get_nested(payload, keys)
         if isinstance(val, str) and "@" in val:
             return val.strip().lower()
     return None
 
 
 def _extract_product_key(payload: dict) -> str | None:
-    candidates = [
-        "product_id",
-        "product.id",
-        "product",
-        "product_name",
-        "product.name",
-        "offer.name",
-    ]
-    for path in candidates:
-        val = _get_nested(payload, path)
+    for keys in _PRODUCT_KEY_PATHS:
+        val = _get_nested(payload, keys)
         if isinstance(val, str) and val.strip():
             return val.strip()
     return None
 
 
 def _extract_event_id(payload: dict) -> str | None:
-    candidates = [
-        "transaction_id",
-        "order_id",
-        "id",
-        "event_id",
-    ]
-    for path in candidates:
-        val = _get_nested(payload, path)
+    for keys in _EVENT_ID_PATHS:
+        val = _get_nested(payload, keys)
         if isinstance(val, str) and val.strip():
             return val.strip()
         if isinstance(val, (int, float)):
@@ -1011,33 +1232,90 @@ def _extract_event_id(payload: dict) -> str | None:
     return None
 
 
+_APPROVED = frozenset({"compra_aprovada", "approved", "paid", "payment_approved", "payment_confirmed"})
+# Kiwify events that never come with an approved payment
+_NON_APPROVAL_EVENTS = frozenset({
+    "carrinho_abandonado",
+    "boleto_gerado",
+    "pix_gerado",
+    "compra_recusada",
+    "compra_reembolsada",
+    "chargeback",
+    "subscription_canceled",
+    "subscription_late",
+})
+
+
 def _is_approved(payload: dict) -> bool:
-    event = str(payload.get("event") or payload.get("trigger") or payload.get("type") or "").lower()
-    status = str(payload.get("status") or payload.get("payment_status") or "").lower()
-    approved = {"compra_aprovada", "approved", "paid", "payment_approved", "payment_confirmed"}
-    return event in approved or status in approved
+    event = payload.get("event") or payload.get("trigger") or payload.get("type")
+    if isinstance(event, str) and event.lower() in _APPROVED:
+        return True
+    status = payload.get("status") or payload.get("payment_status")
+    return isinstance(status, str) and status.lower() in _APPROVED
 
 
-def _load_kiwify_mapping() -> dict:
-    raw = os.environ.get("KIWIFY_PRODUCT_CREDITS", "").strip()
+@functools.lru_cache(maxsize=4)
+def _parse_kiwify_mapping(raw: str) -> dict:
+    # Keyed on the raw env value, so a changed mapping is parsed again; keys are lowered
+    # and credit amounts converted once here
     if not raw:
         return {}
     try:
-        return json.loads(raw)
+        raw_map = json_utils.loads(raw)
     except Exception:
         logger.warning("Invalid KIWIFY_PRODUCT_CREDITS JSON")
         return {}
+    if not isinstance(raw_map, dict):
+        logger.warning("KIWIFY_PRODUCT_CREDITS must be a JSON object")
+        return {}
+
+    # A bad entry only drops that product, never the whole mapping
+    mapping = {}
+    for k, v in raw_map.items():
+        key = str(k).lower()
+        try:
+            amount = int(v)
+        except (TypeError, ValueError):
+            logger.warning("Skipping KIWIFY_PRODUCT_CREDITS entry %r: invalid credit amount %r", k, v)
+            continue
+        if key in mapping:
+            logger.warning("KIWIFY_PRODUCT_CREDITS keys collide on %r after lowercasing; using %r", key, k)
+        mapping[key] = amount
+    return mapping
+
+
+def _load_kiwify_mapping() -> dict:
+    return _parse_kiwify_mapping(os.environ.get("KIWIFY_PRODUCT_CREDITS", "").strip())
 
 
 def _map_credits(product_key: str | None, mapping: dict) -> int | None:
-    if not product_key:
+    return mapping.get(product_key.lower()) if product_key else None
+
+
+def _find_user_by_email(db, email: str):
+    index_ref = _email_index_ref(db, email)
+    snap = index_ref.get(field_paths=["uid"])
+    uid = (snap.to_dict() or {}).get("uid") if snap.exists else None
+    if uid:
+        # Trust the entry only while that account still has this email
+        user_ref = db.collection("users").document(uid)
+        user_snap = user_ref.get(field_paths=["email"])
+        indexed_email = (user_snap.to_dict() or {}).get("email") if user_snap.exists else None
+        if isinstance(indexed_email, str) and indexed_email.strip().lower() == email.strip().lower():
+            return user_ref
+    # Missing entry (accounts created before the index existed) or a stale one: query and repair
+    docs = db.collection("users").where("email", "==", email).limit(1).get()
+    if not docs:
         return None
-    if product_key in mapping:
-        return int(mapping[product_key])
-    for k, v in mapping.items():
-        if isinstance(k, str) and k.lower() == product_key.lower():
-            return int(v)
-    return None
+    try:
+        if snap.exists:
+            # Only replace the stale entry we read; a concurrent repair wins
+            index_ref.update({"uid": docs[0].id}, option=db.write_option(last_update_time=snap.update_time))
+        else:
+            index_ref.create({"uid": docs[0].id})
+    except (AlreadyExists, FailedPrecondition):
+        pass
+    return docs[0].reference
 
 
 async def _handle_kiwify_payload(payload: dict):
@@ -1058,43 +1336,70 @@ async def _handle_kiwify_payload(payload: dict):
     if not event_id:
         return {"ok": True, "ignored": "missing_transaction_id"}
 
+    return await asyncio.to_thread(_credit_purchase, email, product_key, credits, event_id, payload)
+
+
+def _credit_purchase(email: str, product_key: str | None, credits: int, event_id: str, payload: dict) -> dict:
+    # Blocking Firestore reads and the credit transaction, whose contention retries
+    # sleep; run in a worker thread so a busy webhook never stalls the event loop
     db = get_firestore_client()
     ledger_ref = db.collection("credits_ledger").document(event_id)
-    if ledger_ref.get().exists:
+    if ledger_ref.get(field_paths=["status"]).exists:
         return {"ok": True, "ignored": "duplicate"}
 
-    user_query = db.collection("users").where("email", "==", email).limit(1).get()
-    if not user_query:
+    user_ref = _find_user_by_email(db, email)
+    if user_ref is None:
         ledger_ref.set({"email": email, "status": "user_not_found", "payload": payload}, merge=True)
         return {"ok": True, "ignored": "user_not_found"}
 
-    user_ref = user_query[0].reference
-    user_ref.set({"credits": firestore.Increment(int(credits)), "updatedAt": now_iso()}, merge=True)
-    ledger_ref.set(
-        {
-            "email": email,
-            "credits": int(credits),
-            "product": product_key,
-            "status": "credited",
-            "createdAt": now_iso(),
-            "payload": payload,
-        },
-        merge=True,
-    )
+    # Credit and ledger entry commit together; the ledger re-read inside the
+    # transaction keeps concurrent deliveries of the same event from double-crediting
+    @firestore.transactional
+    def _tx_credit(transaction):
+        if ledger_ref.get(field_paths=["status"], transaction=transaction).exists:
+            return False
+        transaction.set(user_ref, {"credits": firestore.Increment(int(credits)), "updatedAt": firestore.SERVER_TIMESTAMP}, merge=True)
+        transaction.set(
+            ledger_ref,
+            {
+                "email": email,
+                "credits": int(credits),
+                "product": product_key,
+                "status": "credited",
+                "createdAt": firestore.SERVER_TIMESTAMP,
+                "payload": payload,
+            },
+            merge=True,
+        )
+        return True
+
+    credited = _tx_credit(db.transaction())
+    _CREDITS_CACHE.pop(user_ref.id)
+    if not credited:
+        return {"ok": True, "ignored": "duplicate"}
     return {"ok": True, "credited": int(credits)}
 
 
+_KIWIFY_WEBHOOK_TOKEN = os.environ.get("KIWIFY_WEBHOOK_TOKEN")
+
+
 @app.post("/webhooks/kiwify")
 async def kiwify_webhook(request: Request):
-    token_required = os.environ.get("KIWIFY_WEBHOOK_TOKEN")
-    if token_required:
+    if _KIWIFY_WEBHOOK_TOKEN:
         header_token = request.headers.get("x-kiwify-token") or request.headers.get("X-Kiwify-Token")
         query_token = request.query_params.get("token")
-        if token_required != (header_token or query_token):
+        if _KIWIFY_WEBHOOK_TOKEN != (header_token or query_token):
             raise HTTPException(status_code=401, detail="Invalid webhook token")
 
+    # Most deliveries are not approvals; when the event is named outside the body and can
+    # never carry an approved status, skip reading it. Any other event falls through, since
+    # _is_approved also accepts an approved status/payment_status under a neutral event.
+    event_hint = request.query_params.get("event") or request.headers.get("x-kiwify-event")
+    if event_hint and event_hint.lower() in _NON_APPROVAL_EVENTS:
+        return {"ok": True, "ignored": "not_approved"}
+
     try:
-        payload = await request.json()
+        payload = json_utils.loads(await request.body())
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
@@ -1106,15 +1411,14 @@ async def kiwify_webhook(request: Request):
 
 @app.post("/webhooks/kiwify/test")
 async def kiwify_webhook_test(request: Request):
-    token_required = os.environ.get("KIWIFY_WEBHOOK_TOKEN")
-    if token_required:
+    if _KIWIFY_WEBHOOK_TOKEN:
         header_token = request.headers.get("x-kiwify-token") or request.headers.get("X-Kiwify-Token")
         query_token = request.query_params.get("token")
-        if token_required != (header_token or query_token):
+        if _KIWIFY_WEBHOOK_TOKEN != (header_token or query_token):
             raise HTTPException(status_code=401, detail="Invalid webhook token")
 
     try:
-        payload = await request.json()
+        payload = json_utils.loads(await request.body())
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
@@ -1123,3 +1427,9 @@ async def kiwify_webhook_test(request: Request):
 
     payload.setdefault("event", "compra_aprovada")
     return await _handle_kiwify_payload(payload)
+
+
+# Firebase Hosting forwards /api/** with the prefix intact; serve the same route table
+# under /api through a mount instead of rewriting every request path. Keep this last so
+# the copied table includes every route above.
+app.mount("/api", Router(routes=app.router.routes))
@@ -1,6 +1,9 @@
+from functools import cached_property
 from typing import Any, Dict, List, Optional
 from pydantic import BaseModel, Field
 
+from . import json_utils
+
 LanguageCode = str
 Track = str
 Seniority = str
@@ -26,6 +29,11 @@ class InterviewConfig(BaseModel):
     jobDescription: Optional[str] = None
     plan: PlanType
 
+    @cached_property
+    def config_json(self) -> str:
+        # Rendered once per config and reused by every prompt built from it
+        return json_utils.dumps(self.model_dump()).decode("utf-8")
+
 class InterviewQuestion(BaseModel):
     id: str
     section: str
@@ -0,0 +1,9 @@
+import os
+
+
+def env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment, falling back to default when unset or invalid."""
+    try:
+        return int(os.environ.get(name, default))
+    except Exception:
+        return int(default)
@@ -1,15 +1,139 @@
+import asyncio
+import hashlib
 import os
-import json
+import tempfile
 from typing import Optional
-import urllib.request
-import urllib.error
 
+import httpx
 from google.cloud import texttospeech
 
+from . import json_utils
+from .cache import TTLCache
+from .http_client import HTTP as _OPENAI_HTTP
+from .settings import env_int
 
-def _synthesize_google(text: str, language_code: str = "pt-BR", voice_name: Optional[str] = None, ssml_gender: str = "FEMALE") -> bytes:
+
+# Provider settings, read once at import
+_TTS_PROVIDER = (os.environ.get("TTS_PROVIDER") or "google").strip().lower()
+_TTS_FALLBACK = (os.environ.get("TTS_FALLBACK") or "").strip().lower()
+_OPENAI_TTS_MODEL = os.environ.get("OPENAI_TTS_MODEL", "gpt-4o-mini-tts").strip()
+_OPENAI_TTS_VOICE = os.environ.get("OPENAI_TTS_VOICE", "coral").strip()
+_OPENAI_TTS_FORMAT = os.environ.get("OPENAI_TTS_FORMAT", "mp3").strip()
+_OPENAI_TTS_INSTRUCTIONS = os.environ.get("OPENAI_TTS_INSTRUCTIONS")
+# Every setting that changes the produced audio; part of each cache key
+_CONFIG_KEY_PARTS = (_TTS_PROVIDER, _OPENAI_TTS_MODEL, _OPENAI_TTS_VOICE, _OPENAI_TTS_FORMAT, _OPENAI_TTS_INSTRUCTIONS or "")
+
+
+def _mime_for_format(fmt: str) -> str:
+    if fmt in ("wav", "wave"):
+        return "audio/wav"
+    if fmt in ("ogg", "opus"):
+        return "audio/ogg"
+    return "audio/mpeg"
+
+
+# MIME type of the audio synthesize_text returns, for callers building responses
+AUDIO_MIME_TYPE = _mime_for_format(_OPENAI_TTS_FORMAT.lower())
+
+
+# Interviewer questions are read aloud again and again, so keep recent audio around
+_TTS_CACHE = TTLCache(
+    maxsize=env_int("TTS_CACHE_MAX_ENTRIES", 256),
+    ttl=env_int("TTS_CACHE_TTL_SECONDS", 24 * 3600),
+)
+
+
+def _cache_key(*parts: str) -> bytes:
+    hasher = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        hasher.update(part.encode("utf-8"))
+        hasher.update(b"\x00")
+    return hasher.digest()
+
+
+# Opt-in content-addressed second tier under _TTS_CACHE that outlives the process.
+# Off unless TTS_DISK_CACHE_DIR is set (Cloud Run's /tmp is memory-backed); bounded to
+# TTS_DISK_CACHE_MAX_FILES entries, evicting the least recently used
+_DISK_CACHE_DIR = os.environ.get("TTS_DISK_CACHE_DIR", "").strip()
+_DISK_CACHE_MAX_FILES = env_int("TTS_DISK_CACHE_MAX_FILES", 512)
+# Only files named <key hex><suffix> are cache entries; eviction never touches anything
+# else in the directory, including other writers' in-flight temp files
+_DISK_CACHE_SUFFIX = ".tts"
+_DISK_CACHE_TMP_PREFIX = ".tts-tmp-"
+
+
+def _disk_cache_path(key: bytes) -> str:
+    return os.path.join(_DISK_CACHE_DIR, key.hex() + _DISK_CACHE_SUFFIX)
+
+
+def _read_disk_cache(key: bytes) -> Optional[bytes]:
+    if not _DISK_CACHE_DIR:
+        return None
+    path = _disk_cache_path(key)
+    try:
+        with open(path, "rb") as f:
+            audio = f.read()
+        os.utime(path)  # mtime doubles as the LRU clock
+        return audio
+    except OSError:
+        return None
+
+
+def _entry_mtime(entry: os.DirEntry) -> float:
+    try:
+        return entry.stat().st_mtime
+    except OSError:  # removed by another writer since the scan
+        return 0.0
+
+
+def _evict_disk_cache() -> None:
+    with os.scandir(_DISK_CACHE_DIR) as it:
+        entries = [
+            e for e in it
+            if e.name.endswith(_DISK_CACHE_SUFFIX) and not e.name.startswith(_DISK_CACHE_TMP_PREFIX) and e.is_file()
+        ]
+    excess = len(entries) - _DISK_CACHE_MAX_FILES
+    if excess <= 0:
+        return
+    entries.sort(key=_entry_mtime)
+    for entry in entries[:excess]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _write_disk_cache(key: bytes, audio: bytes) -> None:
+    if not _DISK_CACHE_DIR:
+        return
+    try:
+        os.makedirs(_DISK_CACHE_DIR, exist_ok=True)
+        # Write to a temp file and rename so concurrent readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=_DISK_CACHE_DIR, prefix=_DISK_CACHE_TMP_PREFIX)
+        with os.fdopen(fd, "wb") as f:
+            f.write(audio)
+        os.replace(tmp_path, _disk_cache_path(key))
+        _evict_disk_cache()
+    except OSError:
+        pass
+
+
+_google_client: Optional[texttospeech.TextToSpeechAsyncClient] = None
+_GOOGLE_AUDIO_CONFIG = texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.MP3)
+
+
+def _get_google_client() -> texttospeech.TextToSpeechAsyncClient:
+    # Creating the client sets up credentials and a gRPC channel, so do it once
+    # (lazily, from inside the serving event loop the aio channel binds to)
+    global _google_client
+    if _google_client is None:
+        _google_client = texttospeech.TextToSpeechAsyncClient()
+    return _google_client
+
+
+async def _synthesize_google(text: str, language_code: str = "pt-BR", voice_name: Optional[str] = None, ssml_gender: str = "FEMALE") -> bytes:
     """Synthesize text using Google Cloud Text-to-Speech and return MP3 bytes."""
-    client = texttospeech.TextToSpeechClient()
+    client = _get_google_client()
 
     voice = texttospeech.VoiceSelectionParams(
         language_code=language_code,
@@ -18,62 +142,63 @@ def _synthesize_google(text: str, language_code: str = "pt-BR", voice_name: Opti
     if voice_name:
         voice.name = voice_name
 
-    audio_config = texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.MP3)
     synthesis_input = texttospeech.SynthesisInput(text=text)
-    response = client.synthesize_speech(input=synthesis_input, voice=voice, audio_config=audio_config)
+    response = await client.synthesize_speech(input=synthesis_input, voice=voice, audio_config=_GOOGLE_AUDIO_CONFIG)
     return response.audio_content
 
 
-def _synthesize_openai(text: str, language_code: str = "pt-BR", voice_name: Optional[str] = None) -> bytes:
+async def _synthesize_openai(text: str, language_code: str = "pt-BR", voice_name: Optional[str] = None) -> bytes:
     """Synthesize text using OpenAI Audio API and return audio bytes."""
     api_key = (os.environ.get("OPENAI_API_KEY") or "").strip()
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY nao configurada")
 
-    model = os.environ.get("OPENAI_TTS_MODEL", "gpt-4o-mini-tts").strip()
-    voice = (voice_name or os.environ.get("OPENAI_TTS_VOICE", "coral")).strip()
-    response_format = os.environ.get("OPENAI_TTS_FORMAT", "mp3").strip()
-    instructions = os.environ.get("OPENAI_TTS_INSTRUCTIONS")
-
     payload = {
-        "model": model,
+        "model": _OPENAI_TTS_MODEL,
         "input": text,
-        "voice": voice,
-        "response_format": response_format,
+        "voice": voice_name.strip() if voice_name else _OPENAI_TTS_VOICE,
+        "response_format": _OPENAI_TTS_FORMAT,
     }
-    if instructions:
-        payload["instructions"] = instructions
-
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(
-        "https://api.openai.com/v1/audio/speech",
-        data=data,
-        headers={
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        },
-        method="POST",
-    )
+    if _OPENAI_TTS_INSTRUCTIONS:
+        payload["instructions"] = _OPENAI_TTS_INSTRUCTIONS
 
     try:
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            return resp.read()
-    except urllib.error.HTTPError as e:
-        body = e.read().decode("utf-8", errors="ignore")
-        raise RuntimeError(f"OpenAI TTS error: {e.code} {body}") from e
+        resp = await _OPENAI_HTTP.post(
+            "/audio/speech",
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+            content=json_utils.dumps(payload),
+        )
+        resp.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        body = e.response.content.decode("utf-8", errors="ignore")
+        raise RuntimeError(f"OpenAI TTS error: {e.response.status_code} {body}") from e
+    return resp.content
+
 
+async def synthesize_text(text: str, language_code: str = "pt-BR", voice_name: Optional[str] = None, ssml_gender: str = "FEMALE") -> bytes:
+    """Synthesize text using configured provider and return audio bytes (cached per text/voice/format)."""
+    key = _cache_key(*_CONFIG_KEY_PARTS, language_code, voice_name or "", ssml_gender, text)
+    audio = _TTS_CACHE.get(key)
+    if audio is None:
+        audio = await asyncio.to_thread(_read_disk_cache, key)
+        if audio is not None:
+            _TTS_CACHE.set(key, audio)
+            return audio
+        audio, provider_used = await _synthesize(_TTS_PROVIDER, text, language_code, voice_name, ssml_gender)
+        # Fallback audio is served but not stored under the configured provider's key
+        if provider_used == _TTS_PROVIDER:
+            await asyncio.to_thread(_write_disk_cache, key, audio)
+            _TTS_CACHE.set(key, audio)
+    return audio
 
-def synthesize_text(text: str, language_code: str = "pt-BR", voice_name: Optional[str] = None, ssml_gender: str = "FEMALE") -> bytes:
-    """Synthesize text using configured provider and return audio bytes."""
-    provider = (os.environ.get("TTS_PROVIDER") or "google").strip().lower()
-    fallback = (os.environ.get("TTS_FALLBACK") or "").strip().lower()
 
+async def _synthesize(provider: str, text: str, language_code: str, voice_name: Optional[str], ssml_gender: str) -> tuple[bytes, str]:
     if provider == "openai":
         try:
-            return _synthesize_openai(text=text, language_code=language_code, voice_name=voice_name)
+            return await _synthesize_openai(text=text, language_code=language_code, voice_name=voice_name), "openai"
         except Exception:
-            if fallback == "google":
-                return _synthesize_google(text=text, language_code=language_code, voice_name=voice_name, ssml_gender=ssml_gender)
+            if _TTS_FALLBACK == "google":
+                return await _synthesize_google(text=text, language_code=language_code, voice_name=voice_name, ssml_gender=ssml_gender), "google"
             raise
 
-    return _synthesize_google(text=text, language_code=language_code, voice_name=voice_name, ssml_gender=ssml_gender)
+    return await _synthesize_google(text=text, language_code=language_code, voice_name=voice_name, ssml_gender=ssml_gender), "google"
@@ -5,6 +5,7 @@ Script de diagnóstico para verificar configuração de AI em produção
 Execute este script no ambiente de produção para diagnosticar problemas
 """
 
+import asyncio
 import os
 import sys
 import json
@@ -98,12 +99,12 @@ def check_ai_providers() -> Dict[str, Any]:
         # Testar geração simples se algum provider estiver configurado
         if any(p.is_configured() for p in router.providers.values()):
             try:
-                test_result = router.generate(
+                test_result = asyncio.run(router.generate(
                     task_name="plan",
                     prompt="Test: respond OK",
                     max_tokens=5,
                     temperature=0.0
-                )
+                ))
                 result["test_generation"] = {
                     "success": True,
                     "provider_used": test_result.provider_used,
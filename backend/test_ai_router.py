@@ -4,6 +4,7 @@
 Teste simples do AIRouter para detectar problemas nas chaves de API
 """
 
+import asyncio
 import os
 import sys
 sys.path.append('.')
@@ -37,13 +38,13 @@ def test_ai_router():
     # Tentar gerar algo simples
     print("\n=== Teste de geração ===")
     try:
-        result = router.generate(
+        result = asyncio.run(router.generate(
             task_name="plan",
             prompt="Responda apenas: 'OK'",
             max_tokens=10,
             temperature=0.0,
             response_mime_type="text/plain"
-        )
+        ))
         print(f"SUCCESS: {result.provider_used} | {result.model_used} | {result.output_text}")
     except AIProviderError as e:
         print(f"AIProviderError: {e}")
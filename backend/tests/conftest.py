@@ -5,3 +5,185 @@ import sys
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
+
+
+import pytest
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
+from google.cloud import firestore
+
+@pytest.fixture
+def interview_config():
+    """Minimal valid InterviewConfig payload; a fresh dict per test."""
+    return {
+        "uiLanguage": "pt-BR",
+        "interviewLanguage": "pt-BR",
+        "track": "backend",
+        "seniority": "mid",
+        "stacks": ["python"],
+        "style": "friendly",
+        "duration": 20,
+        "plan": "free",
+    }
+
+
+# In-memory Firestore stand-in. Documents live in FakeFirestore.docs keyed by path,
+# every write bumps a per-path version that doubles as update_time, and callables
+# queued in `interleave` run right before the next update, batch/transaction commit
+# or transaction body, simulating a concurrent write landing there.
+class FakeSnapshot:
+    def __init__(self, ref, data, update_time=0):
+        self.reference = ref
+        self.id = ref.id
+        self._data = data
+        self.exists = data is not None
+        self.update_time = update_time
+
+    def to_dict(self):
+        return dict(self._data or {})
+
+
+class FakeDocument:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return FakeCollection(self.db, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None):
+        self.db.reads += 1
+        return FakeSnapshot(self, self.db.docs.get(self.path), self.db.versions.get(self.path, 0))
+
+    def create(self, data):
+        if self.path in self.db.docs:
+            raise AlreadyExists("exists")
+        self.db.apply(self.path, data, merge=False)
+
+    def set(self, data, merge=False):
+        self.db.apply(self.path, data, merge=merge)
+
+    def update(self, data, option=None):
+        self.db.run_interleaved()
+        self.db.check(self.path, option)
+        self.db.apply(self.path, data, merge=True)
+
+    def delete(self):
+        self.db.docs.pop(self.path, None)
+
+
+class FakeQuery:
+    def __init__(self, db, path, field, value):
+        self.db = db
+        self.path = path
+        self.field = field
+        self.value = value
+        self.count = None
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    def get(self):
+        self.db.queries += 1
+        prefix = self.path + "/"
+        hits = [
+            FakeSnapshot(FakeDocument(self.db, path), data)
+            for path, data in self.db.docs.items()
+            if path.startswith(prefix) and "/" not in path[len(prefix):] and data.get(self.field) == self.value
+        ]
+        return hits[: self.count]
+
+
+class FakeCollection:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+
+    def document(self, doc_id=None):
+        return FakeDocument(self.db, f"{self.path}/{doc_id or f'auto{len(self.db.docs)}'}")
+
+    def where(self, field, op, value):
+        assert op == "=="
+        return FakeQuery(self.db, self.path, field, value)
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data, merge=False):
+        self.writes.append((ref.path, data, merge, None))
+
+    def update(self, ref, data, option=None):
+        self.writes.append((ref.path, data, True, option))
+
+    def commit(self):
+        self.db.run_interleaved()
+        # All-or-nothing, like the real commit
+        for path, _, _, option in self.writes:
+            self.db.check(path, option)
+        for path, data, merge, _ in self.writes:
+            self.db.apply(path, data, merge=merge)
+        self.db.commits.append([(path, data) for path, data, _, _ in self.writes])
+
+
+class FakeFirestore:
+    def __init__(self, docs=None):
+        self.docs = dict(docs or {})
+        self.versions = {path: 1 for path in self.docs}
+        self.reads = 0
+        self.queries = 0
+        self.commits = []
+        self.interleave = []
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def transaction(self):
+        return FakeBatch(self)
+
+    def write_option(self, last_update_time):
+        return last_update_time
+
+    def run_interleaved(self):
+        if self.interleave:
+            self.interleave.pop(0)(self)
+
+    def check(self, path, option):
+        if option is not None and option != self.versions.get(path, 0):
+            raise FailedPrecondition("stale")
+
+    def apply(self, path, data, merge):
+        doc = dict(self.docs.get(path) or {}) if merge else {}
+        for key, value in data.items():
+            if isinstance(value, firestore.Increment):
+                doc[key] = doc.get(key, 0) + value.value
+            else:
+                doc[key] = value
+        self.docs[path] = doc
+        self.versions[path] = self.versions.get(path, 0) + 1
+
+
+def _fake_transactional(fn):
+    def run(transaction, *args, **kwargs):
+        transaction.db.run_interleaved()
+        result = fn(transaction, *args, **kwargs)
+        transaction.commit()
+        return result
+    return run
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    from app import main as main_module
+
+    db = FakeFirestore()
+    monkeypatch.setattr(main_module, "get_firestore_client", lambda: db)
+    monkeypatch.setattr(firestore, "transactional", _fake_transactional)
+    main_module._CREDITS_CACHE.clear()
+    return db
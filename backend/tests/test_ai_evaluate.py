@@ -3,8 +3,9 @@ import json
 
 from fastapi.testclient import TestClient
 
+from app import main as main_module
 from app.main import app
-from app.ai.router import AIResult
+from app.ai.router import AIProviderError, AIResult
 from app.firebase_admin import get_current_user
 
 
@@ -35,7 +36,7 @@ def test_evaluate_audio_happy_path(monkeypatch):
         "followUpQuestion": None,
     }
 
-    def fake_generate(*args, **kwargs):
+    async def fake_generate(*args, **kwargs):
         return AIResult(
             output_text=json.dumps(payload),
             provider_used="test",
@@ -75,3 +76,179 @@ def test_evaluate_audio_happy_path(monkeypatch):
         assert data["followUpNeeded"] is False
     finally:
         app.dependency_overrides = {}
+
+
+def test_evaluate_audio_upload_accepts_multipart(monkeypatch, interview_config):
+    app.dependency_overrides[get_current_user] = lambda: {"uid": "test-user"}
+    monkeypatch.setattr('app.main._debit_credits', lambda uid, amount=1: 0)
+    seen = {}
+
+    async def fake_generate(*args, **kwargs):
+        seen["media"] = kwargs.get("media")
+        return AIResult(
+            output_text=json.dumps({
+                "transcript": "ok",
+                "scores": {"communication": 7, "technical": 6, "problemSolving": 5, "presence": 8},
+            }),
+            provider_used="test",
+            model_used="test-model",
+            latency_ms=5,
+        )
+
+    monkeypatch.setattr('app.main.ai_router.generate', fake_generate)
+
+    try:
+        client = TestClient(app)
+        resp = client.post(
+            '/ai/evaluate-audio/upload',
+            data={"config": json.dumps(interview_config), "question": "Explique o que e uma API."},
+            files={"file": ("answer.webm", b"raw-audio", "audio/webm")},
+        )
+        assert resp.status_code == 200
+        assert resp.json()["transcript"] == "ok"
+        assert seen["media"] == [{"data": b"raw-audio", "mime_type": "audio/webm"}]
+    finally:
+        app.dependency_overrides = {}
+
+
+def test_evaluate_audio_uses_speculative_transcript_on_failure(monkeypatch, interview_config):
+    app.dependency_overrides[get_current_user] = lambda: {"uid": "test-user"}
+    monkeypatch.setattr('app.main._debit_credits', lambda uid, amount=1: 0)
+    monkeypatch.setattr('app.main._refund_credits', lambda uid, amount=1: None)
+    monkeypatch.setattr('app.main._SPECULATIVE_TRANSCRIBE', True)
+    transcribed = []
+
+    async def fake_transcribe(data, mime):
+        transcribed.append(data)
+        return "texto falado"
+
+    monkeypatch.setattr('app.main._openai_transcribe_audio', fake_transcribe)
+
+    async def fake_generate(*args, **kwargs):
+        if kwargs.get("media"):
+            raise AIProviderError("audio not supported", status_code=503)
+        return AIResult(
+            output_text=json.dumps({
+                "scores": {"communication": 7, "technical": 6, "problemSolving": 5, "presence": 8},
+            }),
+            provider_used="test",
+            model_used="test-model",
+            latency_ms=5,
+        )
+
+    monkeypatch.setattr('app.main.ai_router.generate', fake_generate)
+
+    try:
+        client = TestClient(app)
+        resp = client.post(
+            '/ai/evaluate-audio/upload',
+            data={"config": json.dumps(interview_config), "question": "Explique o que e uma API."},
+            files={"file": ("answer.webm", b"raw-audio", "audio/webm")},
+        )
+        assert resp.status_code == 200
+        assert resp.json()["transcript"] == "texto falado"
+        assert transcribed == [b"raw-audio"]
+    finally:
+        app.dependency_overrides = {}
+
+
+def test_name_extract_reuses_result_for_same_audio(monkeypatch):
+    app.dependency_overrides[get_current_user] = lambda: {"uid": "test-user", "email": "test@example.com"}
+    monkeypatch.setattr('app.main._NAME_CACHE', main_module.TTLCache(maxsize=16, ttl=60))
+    calls = []
+
+    async def fake_generate(*args, **kwargs):
+        calls.append(kwargs)
+        return AIResult(output_text="Maria\n", provider_used="test", model_used="test-model", latency_ms=5)
+
+    monkeypatch.setattr('app.main.ai_router.generate', fake_generate)
+
+    try:
+        client = TestClient(app)
+        body = {"audioBase64": base64.b64encode(b'name-audio').decode('utf-8'), "mimeType": "audio/webm", "uiLanguage": "pt-BR"}
+        for _ in range(2):
+            resp = client.post('/ai/name-extract', json=body)
+            assert resp.status_code == 200
+            assert resp.json() == {"name": "Maria"}
+        assert len(calls) == 1
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_final_report_attaches_computed_scores(monkeypatch, interview_config):
+    app.dependency_overrides[get_current_user] = lambda: {"uid": "test-user"}
+    monkeypatch.setattr('app.main._debit_credits', lambda uid, amount=1: 0)
+    report = {"overallScore": 9.9, "levelEstimate": "mid", "jobMatch": {}, "feedback": {}, "plan7Days": []}
+
+    async def fake_generate(*args, **kwargs):
+        return AIResult(output_text=json.dumps(report), provider_used="test", model_used="test-model", latency_ms=5)
+
+    monkeypatch.setattr('app.main.ai_router.generate', fake_generate)
+
+    try:
+        body = {
+            "config": interview_config,
+            "history": [{"evaluation": {"scores": {"communication": 8, "technical": 6, "problemSolving": 7, "presence": 7}}}],
+        }
+        resp = TestClient(app).post('/ai/final-report', json=body)
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["overallScore"] == 7.0
+        assert data["scoresSummary"]["communication"] == 8.0
+    finally:
+        app.dependency_overrides = {}
+
+
+def test_evaluate_alias_awaits_handler(monkeypatch, interview_config):
+    app.dependency_overrides[get_current_user] = lambda: {"uid": "test-user"}
+    monkeypatch.setattr('app.main._debit_credits', lambda uid, amount=1: 0)
+
+    async def fake_generate(*args, **kwargs):
+        return AIResult(
+            output_text=json.dumps({
+                "transcript": "ok",
+                "scores": {"communication": 7, "technical": 6, "problemSolving": 5, "presence": 8},
+            }),
+            provider_used="test",
+            model_used="test-model",
+            latency_ms=5,
+        )
+
+    monkeypatch.setattr('app.main.ai_router.generate', fake_generate)
+
+    try:
+        body = {
+            "config": interview_config,
+            "question": "Explique o que e uma API.",
+            "audioBase64": base64.b64encode(b'test-audio').decode('utf-8'),
+            "mimeType": "audio/webm",
+        }
+        resp = TestClient(app).post('/ai/evaluate', json=body)
+        assert resp.status_code == 200
+        assert resp.json()["transcript"] == "ok"
+    finally:
+        app.dependency_overrides = {}
+
+
+def test_final_report_does_not_cache_invalid_output(monkeypatch, interview_config):
+    app.dependency_overrides[get_current_user] = lambda: {"uid": "test-user"}
+    monkeypatch.setattr('app.main._debit_credits', lambda uid, amount=1: 0)
+    monkeypatch.setattr('app.main._refund_credits', lambda uid, amount=1: None)
+    cached = []
+    monkeypatch.setattr('app.main.ai_router.cache_result', cached.append)
+
+    async def fake_generate(*args, **kwargs):
+        return AIResult(output_text="not a report", provider_used="test", model_used="test-model", latency_ms=5)
+
+    monkeypatch.setattr('app.main.ai_router.generate', fake_generate)
+
+    try:
+        body = {
+            "config": interview_config,
+            "history": [],
+        }
+        resp = TestClient(app).post('/ai/final-report', json=body)
+        assert resp.status_code == 503
+        assert cached == []
+    finally:
+        app.dependency_overrides = {}
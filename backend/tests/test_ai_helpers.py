@@ -1,4 +1,9 @@
+import asyncio
+
+import httpx
+
 from app import main as main_module
+from app.schemas import InterviewConfig
 
 
 def test_safe_json_loads_strips_code_fence():
@@ -40,3 +45,109 @@ def test_normalize_eval_payload_uses_fallback_transcript():
     }
     normalized = main_module._normalize_eval_payload(raw, transcript_fallback="fallback transcript")
     assert normalized["transcript"] == "fallback transcript"
+
+
+def test_build_plan_prompt_embeds_config_json():
+    config = InterviewConfig(
+        uiLanguage="pt-BR",
+        interviewLanguage="pt-BR",
+        track="backend",
+        seniority="pleno",
+        stacks=["python"],
+        style="technical",
+        duration=30,
+        plan="free",
+    )
+    prompt = main_module._build_plan_prompt(config)
+    assert f"Config: {config.config_json}" in prompt
+    assert '"stacks":["python"]' in config.config_json
+    assert "config_json" not in config.model_dump()
+
+
+def test_openai_transcribe_posts_multipart(monkeypatch):
+    seen = {}
+
+    def handler(request):
+        seen["path"] = request.url.path
+        seen["body"] = request.read()
+        return httpx.Response(200, json={"text": " ola mundo "})
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(main_module, "_OPENAI_HTTP", httpx.AsyncClient(base_url="https://api.openai.com/v1", transport=httpx.MockTransport(handler)))
+    assert asyncio.run(main_module._openai_transcribe_audio(b"RIFFdata", "audio/wav")) == "ola mundo"
+    assert seen["path"] == "/v1/audio/transcriptions"
+    assert b"RIFFdata" in seen["body"]
+    assert b'name="model"' in seen["body"]
+
+
+def test_summarize_scores_averages_per_key():
+    history = [
+        {"evaluation": {"scores": {"communication": 8, "technical": "6", "problemSolving": None, "presence": 7}}},
+        {"answerEvaluation": {"communication": 6, "technical": 7, "presence": "n/a"}},
+        "ignored",
+    ]
+    scores, overall = main_module._summarize_scores(history)
+    assert scores.communication == 7.0
+    assert scores.technical == 6.5
+    assert scores.problemSolving == 0.0
+    assert scores.presence == 7.0
+    assert overall == 5.12
+    assert main_module._summarize_scores([{"evaluation": {}}]) is None
+
+
+def test_now_iso_reuses_string_within_a_second(monkeypatch):
+    monkeypatch.setattr(main_module.time, "time", lambda: 1700000000.25)
+    first = main_module.now_iso()
+    monkeypatch.setattr(main_module.time, "time", lambda: 1700000000.75)
+    assert main_module.now_iso() is first
+    assert first == "2023-11-14T22:13:20+00:00"
+    monkeypatch.setattr(main_module.time, "time", lambda: 1700000001.0)
+    assert main_module.now_iso() == "2023-11-14T22:13:21+00:00"
+
+
+def test_kiwify_mapping_parsed_once_and_matched_case_insensitively(monkeypatch):
+    main_module._parse_kiwify_mapping.cache_clear()
+    monkeypatch.setenv("KIWIFY_PRODUCT_CREDITS", '{"Pack-10": 10, "pro": "25"}')
+    mapping = main_module._load_kiwify_mapping()
+    assert main_module._load_kiwify_mapping() is mapping
+    assert main_module._map_credits("pack-10", mapping) == 10
+    assert main_module._map_credits("PRO", mapping) == 25
+    assert main_module._map_credits("other", mapping) is None
+
+    monkeypatch.setenv("KIWIFY_PRODUCT_CREDITS", "not json")
+    assert main_module._load_kiwify_mapping() == {}
+
+
+def test_kiwify_mapping_skips_only_bad_entries(monkeypatch, caplog):
+    main_module._parse_kiwify_mapping.cache_clear()
+    monkeypatch.setenv("KIWIFY_PRODUCT_CREDITS", '{"pack-10": 10, "broken": "abc", "empty": null, "PRO": 20, "pro": 25}')
+    try:
+        mapping = main_module._load_kiwify_mapping()
+    finally:
+        main_module._parse_kiwify_mapping.cache_clear()
+
+    assert mapping == {"pack-10": 10, "pro": 25}
+    assert "'broken'" in caplog.text
+    assert "'empty'" in caplog.text
+    assert "collide on 'pro'" in caplog.text
+
+
+def test_kiwify_extractors_follow_nested_paths():
+    payload = {"customer": {"email": " Buyer@Example.com "}, "product": {"name": "Pack-10"}, "order_id": 42}
+    assert main_module._extract_email(payload) == "buyer@example.com"
+    assert main_module._extract_product_key(payload) == "Pack-10"
+    assert main_module._extract_event_id(payload) == "42"
+    assert main_module._extract_email({"customer": "no-email"}) is None
+
+
+def test_is_approved_checks_event_then_status():
+    assert main_module._is_approved({"event": "Compra_Aprovada"})
+    assert main_module._is_approved({"event": "order_created", "status": "PAID"})
+    assert not main_module._is_approved({"event": "refunded", "type": "paid"})
+    assert not main_module._is_approved({"status": 1})
+
+
+def test_b64_to_bytes_handles_data_url_and_missing_padding():
+    assert main_module._b64_to_bytes("data:audio/webm;base64,YXVkaW8=") == b"audio"
+    assert main_module._b64_to_bytes("YXVkaW8") == b"audio"
+    assert main_module._b64_to_bytes("YXVkaW9z") == b"audios"
@@ -0,0 +1,161 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import http_client
+from app.ai import router as router_module
+from app.ai.router import AIProviderError, AIResult, AIRouter, OpenAIProvider
+from app.main import app
+
+
+def _mock_http(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+class FakeProvider:
+    def __init__(self, name, delay=0.0, error=None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def is_configured(self):
+        return True
+
+    async def generate(self, prompt, model, max_tokens, temperature, response_mime_type=None, media=None, system_prompt=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return AIResult(output_text=self.name, provider_used=self.name, model_used=model, latency_ms=0)
+
+
+def _router(monkeypatch, providers, hedge_delay_ms=0):
+    monkeypatch.setenv("AI_PROVIDER_ORDER", ",".join(providers))
+    router = AIRouter()
+    router.providers = providers
+    router.hedge_delay_ms = hedge_delay_ms
+    return router
+
+
+def _generate(router):
+    return asyncio.run(router.generate(task_name="plan", prompt="hi", max_tokens=10, temperature=0.0))
+
+
+def test_openai_provider_parses_completion(monkeypatch):
+    def handler(request):
+        assert request.headers["authorization"] == "Bearer sk-test-key-123"
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": "ok"}}],
+            "usage": {"total_tokens": 7},
+        })
+
+    monkeypatch.setattr(router_module, "_HTTP", _mock_http(handler))
+    result = asyncio.run(OpenAIProvider("sk-test-key-123").generate(prompt="hi", model="gpt-test", max_tokens=10, temperature=0.0))
+    assert result.output_text == "ok"
+    assert result.tokens_used == 7
+    assert result.provider_used == "openai"
+
+
+def test_openai_provider_maps_rate_limit(monkeypatch):
+    def handler(request):
+        return httpx.Response(429, headers={"retry-after": "12"}, text="slow down")
+
+    monkeypatch.setattr(router_module, "_HTTP", _mock_http(handler))
+    with pytest.raises(AIProviderError) as exc:
+        asyncio.run(OpenAIProvider("sk-test-key-123").generate(prompt="hi", model="gpt-test", max_tokens=10, temperature=0.0))
+    assert exc.value.status_code == 429
+    assert exc.value.retry_after == 12
+    assert exc.value.retryable is True
+    assert str(exc.value) == "slow down"
+
+
+def test_router_falls_back_on_retryable_error(monkeypatch):
+    providers = {
+        "openai": FakeProvider("openai", error=AIProviderError("down", retryable=True)),
+        "groq": FakeProvider("groq"),
+    }
+    result = _generate(_router(monkeypatch, providers))
+    assert result.provider_used == "groq"
+
+
+def test_router_stops_on_non_retryable_error(monkeypatch):
+    providers = {
+        "openai": FakeProvider("openai", error=AIProviderError("bad request", status_code=400, retryable=False)),
+        "groq": FakeProvider("groq"),
+    }
+    with pytest.raises(AIProviderError) as exc:
+        _generate(_router(monkeypatch, providers))
+    assert exc.value.status_code == 400
+    assert providers["groq"].calls == 0
+
+
+def test_router_hedges_slow_provider(monkeypatch):
+    providers = {
+        "openai": FakeProvider("openai", delay=1.0),
+        "groq": FakeProvider("groq", delay=0.01),
+    }
+    result = _generate(_router(monkeypatch, providers, hedge_delay_ms=20))
+    assert result.provider_used == "groq"
+    assert providers["openai"].calls == 1
+
+
+def test_router_times_out_slow_provider(monkeypatch):
+    providers = {
+        "openai": FakeProvider("openai", delay=1.0),
+        "groq": FakeProvider("groq"),
+    }
+    router = _router(monkeypatch, providers)
+    router.task_timeouts_ms["plan"] = 20
+    result = _generate(router)
+    assert result.provider_used == "groq"
+
+
+def test_router_caches_low_temperature_plan_once_validated(monkeypatch):
+    providers = {"openai": FakeProvider("openai")}
+    router = _router(monkeypatch, providers)
+    first = _generate(router)
+    _generate(router)
+    # Nothing is replayed until the caller accepts the output
+    assert providers["openai"].calls == 2
+
+    router.cache_result(first)
+    second = _generate(router)
+    assert first.output_text == second.output_text == "openai"
+    assert second.latency_ms == 0
+    assert second.cache_key is None
+    assert providers["openai"].calls == 2
+
+
+def test_router_does_not_cache_media_calls(monkeypatch):
+    providers = {"openai": FakeProvider("openai")}
+    router = _router(monkeypatch, providers)
+    media = [{"data": b"audio", "mime_type": "audio/webm"}]
+    for _ in range(2):
+        asyncio.run(router.generate(task_name="plan", prompt="hi", max_tokens=10, temperature=0.0, media=media))
+    assert providers["openai"].calls == 2
+
+
+def test_openai_provider_sends_system_prompt_first(monkeypatch):
+    seen = {}
+
+    def handler(request):
+        seen["messages"] = router_module.json_utils.loads(request.content)["messages"]
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+    monkeypatch.setattr(router_module, "_HTTP", _mock_http(handler))
+    asyncio.run(OpenAIProvider("sk-test-key-123").generate(prompt="dynamic", model="gpt-test", max_tokens=10, temperature=0.0, system_prompt="static"))
+    assert seen["messages"] == [
+        {"role": "system", "content": "static"},
+        {"role": "user", "content": "dynamic"},
+    ]
+
+
+def test_app_shutdown_closes_shared_http_pool(monkeypatch):
+    pool = _mock_http(lambda request: httpx.Response(200))
+    monkeypatch.setattr(http_client, "HTTP", pool)
+    with TestClient(app):
+        assert not pool.is_closed
+    assert pool.is_closed
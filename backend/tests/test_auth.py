@@ -0,0 +1,52 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app import firebase_admin as fb
+
+
+@pytest.fixture(autouse=True)
+def _clear_token_cache(monkeypatch):
+    monkeypatch.setattr(fb, "init_firebase", lambda: None)
+    fb._TOKEN_CACHE.clear()
+    yield
+    fb._TOKEN_CACHE.clear()
+
+
+def test_verify_bearer_token_caches_until_exp(monkeypatch):
+    calls = []
+
+    def fake_verify(token):
+        calls.append(token)
+        return {"uid": "u1", "exp": time.time() + 3600}
+
+    monkeypatch.setattr(fb.auth, "verify_id_token", fake_verify)
+    first = fb.verify_bearer_token("Bearer abc")
+    second = fb.verify_bearer_token("Bearer abc")
+    assert first["uid"] == second["uid"] == "u1"
+    assert calls == ["abc"]
+
+
+def test_verify_bearer_token_skips_cache_near_exp(monkeypatch):
+    calls = []
+
+    def fake_verify(token):
+        calls.append(token)
+        return {"uid": "u1", "exp": time.time() + 5}
+
+    monkeypatch.setattr(fb.auth, "verify_id_token", fake_verify)
+    fb.verify_bearer_token("Bearer abc")
+    fb.verify_bearer_token("Bearer abc")
+    assert len(calls) == 2
+
+
+def test_verify_bearer_token_rejects_missing_scheme():
+    with pytest.raises(HTTPException) as exc:
+        fb.verify_bearer_token("Token abc")
+    assert exc.value.status_code == 401
+
+
+def test_verify_bearer_token_accepts_any_scheme_case(monkeypatch):
+    monkeypatch.setattr(fb.auth, "verify_id_token", lambda token: {"uid": token, "exp": 0})
+    assert fb.verify_bearer_token("BEARER  tok-1 ")["uid"] == "tok-1"
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app import main as main_module
+from app.firebase_admin import get_current_user
+
+
+def test_get_user_credits_reuses_cached_balance(fake_db):
+    fake_db.docs["users/u1"] = {"credits": 5}
+
+    assert main_module._get_user_credits("u1") == 5
+    fake_db.docs["users/u1"]["credits"] = 4
+    assert main_module._get_user_credits("u1") == 5
+    assert fake_db.reads == 1
+
+    main_module._CREDITS_CACHE.pop("u1")
+    assert main_module._get_user_credits("u1") == 4
+    assert fake_db.reads == 2
+
+
+def test_charged_refunds_when_work_fails(monkeypatch):
+    calls = []
+    monkeypatch.setattr(main_module, "_debit_credits", lambda uid, amount=1: calls.append(("debit", uid)) or 2)
+    monkeypatch.setattr(main_module, "_refund_credits", lambda uid, amount=1: calls.append(("refund", uid)))
+
+    with main_module._charged("u1") as remaining:
+        assert remaining == 2
+    assert calls == [("debit", "u1")]
+
+    with pytest.raises(HTTPException):
+        with main_module._charged("u1"):
+            raise HTTPException(status_code=503, detail="AI down")
+    assert calls[-1] == ("refund", "u1")
+
+
+def test_debit_credits_retries_after_concurrent_write(fake_db):
+    fake_db.docs["users/u1"] = {"credits": 3}
+    fake_db.interleave.append(lambda db: db.apply("users/u1", {"credits": 2}, merge=True))
+
+    assert main_module._debit_credits("u1") == 1
+    assert fake_db.docs["users/u1"]["credits"] == 1
+    assert fake_db.reads == 2
+
+
+def test_debit_credits_rejects_empty_balance(fake_db):
+    fake_db.docs["users/u1"] = {"credits": 0}
+
+    with pytest.raises(HTTPException) as exc:
+        main_module._debit_credits("u1")
+    assert exc.value.status_code == 402
+
+
+def test_debit_credits_creates_missing_user(fake_db, monkeypatch):
+    monkeypatch.setattr(main_module, "_INITIAL_CREDITS", 3)
+
+    assert main_module._debit_credits("new-user") == 2
+    assert fake_db.docs["users/new-user"]["credits"] == 2
+
+
+def test_find_user_by_email_uses_index_and_backfills(fake_db):
+    fake_db.docs["users/u1"] = {"email": "buyer@example.com"}
+
+    assert main_module._find_user_by_email(fake_db, "buyer@example.com").id == "u1"
+    assert fake_db.queries == 1
+    assert [data for path, data in fake_db.docs.items() if path.startswith("users_by_email/")] == [{"uid": "u1"}]
+
+    assert main_module._find_user_by_email(fake_db, "Buyer@Example.com").id == "u1"
+    assert fake_db.queries == 1
+    assert main_module._find_user_by_email(fake_db, "nobody@example.com") is None
+
+
+def test_email_index_keeps_first_account_for_colliding_email(fake_db, interview_config):
+    fake_db.docs["users/u1"] = {"email": "buyer@example.com", "credits": 1}
+    main_module._claim_email_index(fake_db, "buyer@example.com", "u1")
+    main_module.app.dependency_overrides[get_current_user] = lambda: {"uid": "u2", "email": "Buyer@Example.com"}
+    try:
+        resp = TestClient(main_module.app).post("/sessions/start", json=interview_config)
+    finally:
+        main_module.app.dependency_overrides = {}
+
+    assert resp.status_code == 200
+    assert "users/u2" in fake_db.docs
+    assert [data for path, data in fake_db.docs.items() if path.startswith("users_by_email/")] == [{"uid": "u1"}]
+    assert main_module._find_user_by_email(fake_db, "buyer@example.com").id == "u1"
+
+
+def test_find_user_by_email_repairs_stale_index_entry(fake_db):
+    fake_db.docs["users/u1"] = {"email": "buyer@example.com"}
+    main_module._claim_email_index(fake_db, "buyer@example.com", "u1")
+    # u1 changed their email and another account now owns the address
+    fake_db.docs["users/u1"]["email"] = "new@example.com"
+    fake_db.docs["users/u2"] = {"email": "buyer@example.com"}
+
+    assert main_module._find_user_by_email(fake_db, "buyer@example.com").id == "u2"
+    assert [data for path, data in fake_db.docs.items() if path.startswith("users_by_email/")] == [{"uid": "u2"}]
+
+    fake_db.docs.pop("users/u2")
+    assert main_module._find_user_by_email(fake_db, "buyer@example.com") is None
+
+
+def test_kiwify_webhook_skips_body_for_non_approved_event_hint(monkeypatch):
+    monkeypatch.setattr(main_module, "_KIWIFY_WEBHOOK_TOKEN", None)
+    client = TestClient(main_module.app)
+
+    resp = client.post("/webhooks/kiwify?event=chargeback", content=b"not json")
+    assert resp.json() == {"ok": True, "ignored": "not_approved"}
+
+    resp = client.post("/webhooks/kiwify", content=b"not json")
+    assert resp.status_code == 400
+
+    resp = client.post("/webhooks/kiwify", content=b'{"event": "refunded"}')
+    assert resp.json() == {"ok": True, "ignored": "not_approved"}
+
+    # A neutral event hint is not conclusive: an approved status in the body still counts
+    resp = client.post("/webhooks/kiwify?event=order_updated", content=b'{"status": "paid"}')
+    assert resp.json() == {"ok": True, "ignored": "email_not_found"}
+
+
+def test_kiwify_payload_ignores_duplicate_seen_inside_transaction(fake_db, monkeypatch):
+    main_module._parse_kiwify_mapping.cache_clear()
+    monkeypatch.setenv("KIWIFY_PRODUCT_CREDITS", '{"pack-10": 10}')
+    fake_db.docs["users/u1"] = {"email": "buyer@example.com", "credits": 1}
+    # A concurrent delivery of the same event writes the ledger after the pre-check
+    threads = []
+    fake_db.interleave.append(lambda db: threads.append(threading.current_thread()) or db.apply("credits_ledger/t1", {"status": "credited"}, merge=False))
+    payload = {"status": "paid", "email": "buyer@example.com", "product_id": "pack-10", "transaction_id": "t1"}
+
+    try:
+        result = asyncio.run(main_module._handle_kiwify_payload(payload))
+    finally:
+        main_module._parse_kiwify_mapping.cache_clear()
+
+    assert result == {"ok": True, "ignored": "duplicate"}
+    assert fake_db.docs["users/u1"]["credits"] == 1
+    # The transaction ran off the event loop thread
+    assert threads and threads[0] is not threading.main_thread()
+    assert fake_db.commits == [[]]
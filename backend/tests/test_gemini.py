@@ -0,0 +1,88 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from google.genai import types
+
+from app import gemini as gemini_module
+from app.gemini import EvalOut, GeminiClient, PlanOut, _EVAL_LIST
+from app.schemas import InterviewConfig
+
+
+def _client(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    return GeminiClient()
+
+
+def test_json_config_sends_response_schema(monkeypatch):
+    config = _client(monkeypatch)._json_config(PlanOut)
+    assert config.response_schema is PlanOut
+    assert config.response_mime_type == "application/json"
+
+
+def test_parsed_validates_text_when_sdk_did_not_parse():
+    evaluation = {
+        "scores": {"communication": 7, "technical": 6, "problemSolving": 5, "presence": 8},
+        "transcript": "ok",
+    }
+    resp = types.GenerateContentResponse(candidates=[
+        types.Candidate(content=types.Content(parts=[types.Part.from_text(text=EvalOut(**evaluation).model_dump_json())]))
+    ])
+    assert GeminiClient._parsed(resp, EvalOut).transcript == "ok"
+
+    resp.candidates[0].content.parts[0].text = "[" + EvalOut(**evaluation).model_dump_json() + "]"
+    outs = GeminiClient._parsed(resp, _EVAL_LIST)
+    assert [out.scores.presence for out in outs] == [8]
+
+
+class FakeAio:
+    def __init__(self, outs):
+        self.outs = outs
+        self.uploaded = []
+        self.contents = None
+        self.files = SimpleNamespace(upload=self._upload)
+        self.models = SimpleNamespace(generate_content=self._generate_content)
+
+    async def _upload(self, path, config):
+        self.uploaded.append(path.read())
+        return types.File(name=f"files/{len(self.uploaded)}", uri=f"uri-{len(self.uploaded)}", state=types.FileState.ACTIVE)
+
+    async def _generate_content(self, model, contents, config):
+        self.contents = contents
+        text = "[" + ",".join(out.model_dump_json() for out in self.outs) + "]"
+        return types.GenerateContentResponse(candidates=[
+            types.Candidate(content=types.Content(parts=[types.Part.from_text(text=text)]))
+        ])
+
+
+def _batch_client(monkeypatch, outs):
+    client = _client(monkeypatch)
+    aio = FakeAio(outs)
+    client.client = SimpleNamespace(aio=aio)
+    return client, aio
+
+
+def test_evaluate_answers_batch_shares_inline_budget(monkeypatch, interview_config):
+    monkeypatch.setattr(gemini_module, "INLINE_AUDIO_MAX_BYTES", 10)
+    out = EvalOut(scores={"communication": 7, "technical": 6, "problemSolving": 5, "presence": 8}, transcript="ok")
+    client, aio = _batch_client(monkeypatch, [out, out, out])
+    items = [{"question": f"q{i}", "audio_bytes": f"audio{i}".encode(), "mime_type": "audio/webm"} for i in (1, 2, 3)]
+
+    evaluations = asyncio.run(client.evaluate_answers_batch(InterviewConfig(**interview_config), items))
+
+    assert [e.transcript for e in evaluations] == ["ok", "ok", "ok"]
+    # Only the first 6-byte clip fits the 10-byte budget; the rest are uploaded
+    assert aio.uploaded == [b"audio2", b"audio3"]
+    audio = aio.contents[2:]
+    assert [p.text for p in audio[0::2]] == ["Q1: q1", "Q2: q2", "Q3: q3"]
+    assert audio[1].inline_data.data == b"audio1"
+    assert [p.file_data.file_uri for p in audio[3::2]] == ["uri-1", "uri-2"]
+
+
+def test_evaluate_answers_batch_rejects_count_mismatch(monkeypatch, interview_config):
+    out = EvalOut(scores={"communication": 7, "technical": 6, "problemSolving": 5, "presence": 8}, transcript="ok")
+    client, _ = _batch_client(monkeypatch, [out])
+    items = [{"question": f"q{i}", "audio_bytes": b"a", "mime_type": "audio/webm"} for i in (1, 2)]
+
+    with pytest.raises(ValueError, match="Expected 2 evaluations, got 1"):
+        asyncio.run(client.evaluate_answers_batch(InterviewConfig(**interview_config), items))
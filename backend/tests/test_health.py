@@ -10,3 +10,10 @@ def test_health_ok():
     data = resp.json()
     assert data['ok'] is True
     assert 'time' in data and isinstance(data['time'], str)
+
+
+def test_health_ok_behind_api_prefix():
+    client = TestClient(app)
+    resp = client.get('/api/health')
+    assert resp.status_code == 200
+    assert resp.json()['ok'] is True
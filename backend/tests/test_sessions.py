@@ -0,0 +1,107 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from app import main as main_module
+from app.ai.router import AIResult
+from app.firebase_admin import get_current_user
+from app.main import app
+
+PLAN = {
+    "roleTitleGuess": "Backend",
+    "seniorityGuess": "mid",
+    "mustHaveSkills": ["python"],
+    "blueprint": {"technical": 100},
+    "questions": [{"id": f"q{i}", "section": "technical", "difficulty": 3, "prompt": f"Pergunta {i}?"} for i in range(1, 6)],
+}
+
+
+def _generate_new_plan(fake_db, monkeypatch, interview_config):
+    app.dependency_overrides[get_current_user] = lambda: {"uid": "test-user"}
+    fake_db.docs["sessions/s1"] = {"uid": "test-user", "config": interview_config}
+    fake_db.docs["users/test-user"] = {"credits": 3}
+
+    async def fake_generate(*args, **kwargs):
+        return AIResult(
+            output_text=json.dumps(PLAN),
+            provider_used="test",
+            model_used="test-model",
+            latency_ms=5,
+            tokens_used=10,
+        )
+
+    monkeypatch.setattr('app.main.ai_router.generate', fake_generate)
+    try:
+        return TestClient(app).post("/sessions/s1/plan/generate")
+    finally:
+        app.dependency_overrides = {}
+        main_module._SESSION_PLAN_CACHE.clear()
+
+
+def test_generate_plan_serves_cached_plan_without_firestore_read(fake_db, monkeypatch):
+    app.dependency_overrides[get_current_user] = lambda: {"uid": "test-user"}
+    monkeypatch.setattr(main_module, "_get_user_credits", lambda uid: 2)
+    main_module._SESSION_PLAN_CACHE.set("s1", {
+        "uid": "test-user",
+        "plan": {
+            "roleTitleGuess": "Backend",
+            "seniorityGuess": "mid",
+            "mustHaveSkills": ["python"],
+            "blueprint": {"technical": 100},
+            "questions": [{"id": "q1", "section": "technical", "difficulty": 3, "prompt": "?"}],
+        },
+        "plan_status": "completed",
+        "provider_used": "openai",
+    })
+
+    try:
+        resp = TestClient(app).post("/sessions/s1/plan/generate")
+        assert resp.status_code == 200
+        assert resp.json()["provider_used"] == "openai"
+        assert resp.json()["credits"] == 2
+        assert fake_db.reads == 0
+    finally:
+        app.dependency_overrides = {}
+        main_module._SESSION_PLAN_CACHE.clear()
+
+
+def test_finish_session_commits_all_writes_in_one_batch(fake_db):
+    app.dependency_overrides[get_current_user] = lambda: {"uid": "test-user"}
+    fake_db.docs["sessions/s1"] = {"uid": "test-user", "plan": {"roleTitleGuess": "Backend"}, "config": {"track": "backend"}}
+    report = {"overallScore": 7.5, "levelEstimate": "mid", "jobMatch": {}, "feedback": {}, "plan7Days": []}
+
+    try:
+        resp = TestClient(app).post("/sessions/s1/finish", json={"report": report})
+        assert resp.status_code == 200
+        assert len(fake_db.commits) == 1
+        paths = [path for path, _ in fake_db.commits[0]]
+        assert paths == ["users/test-user", "users/test-user/interviews/s1", "sessions/s1"]
+        assert fake_db.docs["users/test-user/interviews/s1"]["role"] == "Backend"
+        assert fake_db.docs["sessions/s1"]["status"] == "finished"
+        assert fake_db.docs["sessions/s1"]["report"]["overallScore"] == 7.5
+    finally:
+        app.dependency_overrides = {}
+
+
+def test_generate_plan_stores_plan_and_debits_in_one_batch(fake_db, monkeypatch, interview_config):
+    resp = _generate_new_plan(fake_db, monkeypatch, interview_config)
+
+    assert resp.status_code == 200
+    assert resp.json()["credits"] == 2
+    assert len(fake_db.commits) == 1
+    assert [path for path, _ in fake_db.commits[0]] == ["sessions/s1", "users/test-user"]
+    assert fake_db.docs["sessions/s1"]["plan"]["roleTitleGuess"] == "Backend"
+    assert fake_db.docs["users/test-user"]["credits"] == 2
+
+
+def test_generate_plan_falls_back_to_separate_debit_when_balance_moved(fake_db, monkeypatch, interview_config):
+    # Another request spends a credit between the read and the batch commit
+    fake_db.interleave.append(lambda db: db.apply("users/test-user", {"credits": 2}, merge=True))
+
+    resp = _generate_new_plan(fake_db, monkeypatch, interview_config)
+
+    assert resp.status_code == 200
+    assert resp.json()["credits"] == 1
+    assert fake_db.commits == []
+    assert fake_db.docs["users/test-user"]["credits"] == 1
+    assert fake_db.docs["sessions/s1"]["plan_status"] == "completed"
@@ -0,0 +1,135 @@
+import asyncio
+import os
+
+import httpx
+
+from app import tts as tts_module
+
+
+def test_synthesize_text_reuses_cached_audio(monkeypatch):
+    calls = []
+
+    async def fake_google(text, language_code="pt-BR", voice_name=None, ssml_gender="FEMALE"):
+        calls.append(text)
+        return f"audio:{text}".encode()
+
+    monkeypatch.setattr(tts_module, "_TTS_PROVIDER", "google")
+    monkeypatch.setattr(tts_module, "_synthesize_google", fake_google)
+    monkeypatch.setattr(tts_module, "_DISK_CACHE_DIR", "")
+    tts_module._TTS_CACHE.clear()
+
+    assert asyncio.run(tts_module.synthesize_text("Ola")) == b"audio:Ola"
+    assert asyncio.run(tts_module.synthesize_text("Ola")) == b"audio:Ola"
+    assert asyncio.run(tts_module.synthesize_text("Ola", voice_name="pt-BR-Neural2-A")) == b"audio:Ola"
+    assert calls == ["Ola", "Ola"]
+
+
+def test_google_client_is_created_once(monkeypatch):
+    created = []
+
+    class FakeResponse:
+        audio_content = b"mp3"
+
+    class FakeClient:
+        def __init__(self):
+            created.append(self)
+
+        async def synthesize_speech(self, input, voice, audio_config):
+            assert audio_config is tts_module._GOOGLE_AUDIO_CONFIG
+            return FakeResponse()
+
+    monkeypatch.setattr(tts_module.texttospeech, "TextToSpeechAsyncClient", FakeClient)
+    monkeypatch.setattr(tts_module, "_google_client", None)
+
+    assert asyncio.run(tts_module._synthesize_google("Ola")) == b"mp3"
+    assert asyncio.run(tts_module._synthesize_google("Tchau")) == b"mp3"
+    assert len(created) == 1
+
+
+def test_openai_speech_posts_json_through_shared_client(monkeypatch):
+    seen = {}
+
+    def handler(request):
+        seen["url"] = str(request.url)
+        seen["body"] = tts_module.json_utils.loads(request.content)
+        return httpx.Response(200, content=b"mp3-bytes")
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(tts_module, "_OPENAI_HTTP", httpx.AsyncClient(base_url="https://api.openai.com/v1", transport=httpx.MockTransport(handler)))
+
+    assert asyncio.run(tts_module._synthesize_openai("Ola")) == b"mp3-bytes"
+    assert seen["url"] == "https://api.openai.com/v1/audio/speech"
+    assert seen["body"]["input"] == "Ola"
+    assert seen["body"]["voice"] == tts_module._OPENAI_TTS_VOICE
+
+
+def test_synthesize_text_reads_disk_cache_after_memory_eviction(monkeypatch, tmp_path):
+    calls = []
+
+    async def fake_google(text, language_code="pt-BR", voice_name=None, ssml_gender="FEMALE"):
+        calls.append(text)
+        return b"audio"
+
+    monkeypatch.setattr(tts_module, "_TTS_PROVIDER", "google")
+    monkeypatch.setattr(tts_module, "_synthesize_google", fake_google)
+    monkeypatch.setattr(tts_module, "_DISK_CACHE_DIR", str(tmp_path))
+    tts_module._TTS_CACHE.clear()
+
+    assert asyncio.run(tts_module.synthesize_text("Ola")) == b"audio"
+    tts_module._TTS_CACHE.clear()
+    assert asyncio.run(tts_module.synthesize_text("Ola")) == b"audio"
+    assert calls == ["Ola"]
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_disk_cache_evicts_least_recently_used(monkeypatch, tmp_path):
+    monkeypatch.setattr(tts_module, "_DISK_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(tts_module, "_DISK_CACHE_MAX_FILES", 2)
+
+    tts_module._write_disk_cache(b"\x01", b"a")
+    tts_module._write_disk_cache(b"\x02", b"b")
+    os.utime(tmp_path / "01.tts", (0, 0))
+    os.utime(tmp_path / "02.tts", (1, 1))
+    assert tts_module._read_disk_cache(b"\x01") == b"a"  # now the most recent
+    tts_module._write_disk_cache(b"\x03", b"c")
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["01.tts", "03.tts"]
+
+
+def test_disk_cache_eviction_leaves_foreign_files_alone(monkeypatch, tmp_path):
+    monkeypatch.setattr(tts_module, "_DISK_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(tts_module, "_DISK_CACHE_MAX_FILES", 1)
+    (tmp_path / "notes.txt").write_bytes(b"keep")
+    (tmp_path / ".tts-tmp-inflight").write_bytes(b"partial")
+    os.utime(tmp_path / "notes.txt", (0, 0))
+
+    tts_module._write_disk_cache(b"\x01", b"a")
+    os.utime(tmp_path / "01.tts", (0, 0))
+    tts_module._write_disk_cache(b"\x02", b"b")
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == [".tts-tmp-inflight", "02.tts", "notes.txt"]
+
+
+def test_synthesize_text_does_not_store_fallback_audio(monkeypatch, tmp_path):
+    async def failing_openai(text, language_code="pt-BR", voice_name=None):
+        raise RuntimeError("down")
+
+    async def fake_google(text, language_code="pt-BR", voice_name=None, ssml_gender="FEMALE"):
+        return b"google-audio"
+
+    monkeypatch.setattr(tts_module, "_TTS_PROVIDER", "openai")
+    monkeypatch.setattr(tts_module, "_TTS_FALLBACK", "google")
+    monkeypatch.setattr(tts_module, "_synthesize_openai", failing_openai)
+    monkeypatch.setattr(tts_module, "_synthesize_google", fake_google)
+    monkeypatch.setattr(tts_module, "_DISK_CACHE_DIR", str(tmp_path))
+    tts_module._TTS_CACHE.clear()
+
+    assert asyncio.run(tts_module.synthesize_text("Ola")) == b"google-audio"
+    assert len(tts_module._TTS_CACHE) == 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_mime_for_format_maps_openai_formats():
+    assert tts_module._mime_for_format("wav") == "audio/wav"
+    assert tts_module._mime_for_format("opus") == "audio/ogg"
+    assert tts_module._mime_for_format("mp3") == "audio/mpeg"
@@ -164,19 +164,6 @@ const buildFallbackReport = (
   };
 };
 
-const blobToBase64 = (blob: Blob): Promise<string> => {
-  return new Promise((resolve, reject) => {
-    const reader = new FileReader();
-    reader.onerror = () => reject(new Error('Falha ao ler audio.'));
-    reader.onloadend = () => {
-      const result = typeof reader.result === 'string' ? reader.result : '';
-      const base64 = result.split(',')[1] || '';
-      resolve(base64);
-    };
-    reader.readAsDataURL(blob);
-  });
-};
-
 interface InterviewRoomLayoutProps {
   config: InterviewConfig;
   plan: InterviewPlan;
@@ -357,12 +344,10 @@ const InterviewRoomLayout: React.FC<InterviewRoomLayoutProps> = ({ config, plan,
       setFlowState('evaluating');
       try {
         const blob = await stopRecording();
-        const base64Audio = await blobToBase64(blob);
         const response = await BackendApi.evaluateAudio({
           config: sanitizedConfig,
           question: currentQuestion.title,
-          audioBase64: base64Audio,
-          mimeType: blob.type || 'audio/webm',
+          audio: blob,
         });
 
         const nextHistory = [
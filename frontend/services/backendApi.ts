@@ -5,7 +5,8 @@ const API_BASE_URL = (import.meta as any).env?.VITE_API_BASE_URL || "/api";
 
 async function apiFetch<T>(path: string, init: RequestInit = {}): Promise<T> {
   const headers = new Headers(init.headers || {});
-  headers.set("Content-Type", "application/json");
+  // FormData bodies need the browser-generated multipart boundary
+  if (!(init.body instanceof FormData)) headers.set("Content-Type", "application/json");
 
   // Se o caller jÃ¡ passou Authorization, use-o
   if (!headers.get('Authorization')) {
@@ -34,6 +35,11 @@ async function apiFetch<T>(path: string, init: RequestInit = {}): Promise<T> {
   return (await res.json()) as T;
 }
 
+// Recorder blobs can come without a type; the browser would then send application/octet-stream
+function audioFile(blob: Blob, name: string): File {
+  return new File([blob], name, { type: blob.type || "audio/webm" });
+}
+
 export const BackendApi = {
   health: () => apiFetch<{ ok: boolean; time: string }>("/health"),
 
@@ -55,23 +61,27 @@ export const BackendApi = {
   generatePlan: (sessionId: string) =>
     apiFetch<PlanGenerateResponse>(`/sessions/${sessionId}/plan/generate`, { method: "POST" }),
 
-  nameExtract: (audioBase64: string, mimeType = "audio/webm", uiLanguage = "pt-BR") =>
-    apiFetch<{ name: string }>("/ai/name-extract", {
-      method: "POST",
-      body: JSON.stringify({ audioBase64, mimeType, uiLanguage }),
-    }),
+  nameExtract: (audio: Blob, uiLanguage = "pt-BR") => {
+    const form = new FormData();
+    form.append("file", audioFile(audio, "name.webm"));
+    form.append("uiLanguage", uiLanguage);
+    return apiFetch<{ name: string }>("/ai/name-extract/upload", { method: "POST", body: form });
+  },
 
+  // Audio goes up as multipart so it is not inflated by base64 and decoded again on the server
   evaluateAudio: (payload: {
     config: InterviewConfig;
     question: string;
-    audioBase64: string;
-    mimeType?: string;
+    audio: Blob;
     confirmedName?: string;
-  }) =>
-    apiFetch<AnswerEvaluation>("/ai/evaluate-audio", {
-      method: "POST",
-      body: JSON.stringify(payload),
-    }),
+  }) => {
+    const form = new FormData();
+    form.append("file", audioFile(payload.audio, "answer.webm"));
+    form.append("config", JSON.stringify(payload.config));
+    form.append("question", payload.question);
+    if (payload.confirmedName) form.append("confirmedName", payload.confirmedName);
+    return apiFetch<AnswerEvaluation>("/ai/evaluate-audio/upload", { method: "POST", body: form });
+  },
 
   finalReport: (payload: { config: InterviewConfig; history: any[] }) =>
     apiFetch<FinalReport>("/ai/final-report", {